@@ -1,158 +1,320 @@
 import streamlit as st
 import json
-import os
-import pandas as pd
-from geopy.geocoders import Nominatim
-from PIL import Image
-import bcrypt
+import math
+from datetime import date
+from itertools import groupby
+import secrets
+import assets
+import auth
+import changes
+import geocoding
+import dates
+import metrics
+import storage
+from snapshot import get_snapshot, stats as snapshot_stats
 
 # 定数
-DATA_FILE = "data/groups.json"
-ICON_FOLDER = "data/icons"
-DEFAULT_ICON_URL = "data/icons/default_icon.png"
-
-# データ操作関連
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
-    return []
-
-def save_data(data):
-    with open(DATA_FILE, "w", encoding="utf-8") as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
-
-def save_icon(icon_file, group_name):
-    if not os.path.exists(ICON_FOLDER):
-        os.makedirs(ICON_FOLDER)
-    icon_path = os.path.join(ICON_FOLDER, f"{group_name}.png")
-    with open(icon_path, "wb") as f:
-        f.write(icon_file.getbuffer())
-    return icon_path
-
-# パスワードハッシュ化関連
-def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-def check_password(password, hashed):
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+EVENT_PAGE_SIZES = [10, 20, 50]  # イベント一覧の1ページあたりの表示件数
+# ジャンル (イベントのカテゴリー) とジャンル選択ページの画像
+GENRES = [
+    ("新歓", "data/images/shinkan.jpg"),
+    ("勉強会", "data/images/study.jpeg"),
+    ("交流会", "data/images/networking.jpg"),
+    ("スポーツ", "data/images/sports.jpg"),
+    ("ボランティア", "data/images/volunteer.jpg"),
+    ("ものづくり系", "data/images/creation.jpeg"),
+    ("旅行", "data/images/travel.jpg"),
+    ("インターン", "data/images/internship.jpg"),
+    ("追いコン", "data/images/farewell.jpg"),
+]
+EVENT_CATEGORIES = [name for name, _ in GENRES]
+PERIODS = ["開催予定", "今週", "終了したイベントも含む"]  # イベント一覧の期間 (既定は開催予定のイベントだけ)
+# タイトルの背景 (ページの HTML。描画のたびに組み立てず定数をそのまま送る)
+TITLE_HTML = '''
+<style>
+.title-container {
+    font-family: 'Arial', sans-serif; /* フォントを設定 */
+    background-color: #008080; /* 暗い背景色 */
+    padding: 10px; /* 内側の余白を設定 */
+    border-radius: 5px; /* 角を丸くする */
+    text-align: center; /* 中央揃え */
+    width: 100%; /* 横幅を100%に設定 */
+    margin-bottom: 30px; /* タイトル下に余白を追加 */
+}
+.spacer {
+    height: 20px; /* 空白の高さを設定 */
+}
+</style>
+<div class="title-container">
+    <h1 style="color: #ffffff;">Rally</h1>
+    <p style="color: #ffffff;">ー サークル・学生団体と学生を繋ぐ ー</p>
+</div>
+<div class="spacer"></div> <!-- タイトルとタブの間に空白を挿入 -->
+'''
+MAX_MAP_POINTS = 500  # これより多い場合は地図上で近くの点をまとめて表示する
+REVIEW_PAGE_SIZE = 5  # レビューを一度に読み込む件数
+LIVE_UPDATE_SECONDS = 5  # 他のセッションでの変更を確認する間隔 (秒)
+_EVENT_CHANGES = {changes.EVENT_ADDED, changes.EVENT_UPDATED, changes.EVENT_DELETED}
+# タブごとに、表示し直す必要がある変更の種類
+# (応募・レビューは各イベントのカードが次に再実行されたときに反映するので、ページ全体は描画し直さない)
+LIVE_UPDATE_KINDS = {
+    "イベント一覧": _EVENT_CHANGES | {changes.GROUP_ADDED},
+    "ジャンルを選択する": _EVENT_CHANGES,
+    "イベントマップ": _EVENT_CHANGES,
+    "レビューを書く": _EVENT_CHANGES,
+    "サークル管理者画面": _EVENT_CHANGES | {changes.APPLICANT_ADDED, changes.APPLICANT_REMOVED, changes.WAITLIST_ADDED},
+}
+
+# ログイン試行回数の制限に使うクライアントの識別子
+# st.context.ip_address はロードバランサーの後ろではプロキシのアドレスになり、全員が同じ枠を使ってしまうので使わない。
+# 信頼できるプロキシの数 (auth.TRUSTED_PROXIES) が設定されていれば X-Forwarded-For から取り出し、なければセッションごとの乱数を使う
+def client_id():
+    if auth.TRUSTED_PROXIES:
+        # 各プロキシは右端に追加するので、右から TRUSTED_PROXIES 番目が最後のプロキシが受け取った接続元
+        forwarded = [address.strip() for address in ",".join(st.context.headers.get_all("X-Forwarded-For")).split(",")]
+        forwarded = [address for address in forwarded if address]
+        if len(forwarded) >= auth.TRUSTED_PROXIES:
+            return forwarded[-auth.TRUSTED_PROXIES]
+    if "client_id" not in st.session_state:
+        st.session_state["client_id"] = secrets.token_hex(8)
+    return st.session_state["client_id"]
+
+# 他のセッションでの変更の確認 (LIVE_UPDATE_SECONDS ごとにこのフラグメントだけを実行する)
+# 変更フィードで変更の種類を調べ、このタブの表示に関係する変更があったときだけページを描画し直す
+@st.fragment(run_every=LIVE_UPDATE_SECONDS)
+def live_updates(kinds):
+    seen = st.session_state.get("seen_version")
+    version = storage.data_version()
+    if seen is None or version == seen:
+        return
+    st.session_state["seen_version"] = version
+    found = storage.changes_since(seen, version)
+    if found is None or any(change.kind in kinds for change in found):
+        st.rerun()
+
+# ボタンのコールバック: 押された後の再実行の前に状態を変えるので、もう一度 st.rerun() しなくて済む
+def set_state(key, value):
+    st.session_state[key] = value
+
+# 応募フォームの送信 (コールバック): カードを描画し直す前に応募するので、残りの席数がすぐに反映される
+def apply_for_event(event_id, title):
+    name = st.session_state[f"name_{event_id}"]
+    email = st.session_state[f"email_{event_id}"]
+    if not (name and email):
+        result = ("error", "名前とメールアドレスを入力してください。")
+    else:
+        status = storage.add_applicant(event_id, name, email) #応募機能
+        if status == storage.APPLIED:
+            result = ("success", f"{name} さんがイベント '{title}' に応募しました！")
+        elif status == storage.WAITLISTED:
+            result = ("warning", f"定員に達しているため、{name} さんをイベント '{title}' のキャンセル待ちに登録しました。空きが出たら先着順に繰り上がります。")
+        elif status == storage.NOT_FOUND:
+            # イベントのカードはもう表示されないので、カードを並べたページの先頭に表示する (show_apply_error)
+            st.session_state["apply_error"] = f"イベント '{title}' が見つかりません。削除されたか、終了して保管された可能性があります。"
+            return
+        else:
+            result = ("error", "このメールアドレスはすでに応募済みです。")
+    st.session_state[f"apply_result_{event_id}"] = result
+
+# 応募しようとしたイベントが見つからなかったときのエラー (event_card を並べるページごとに先頭で表示する)
+def show_apply_error():
+    if "apply_error" in st.session_state:
+        st.error(st.session_state.pop("apply_error"))
+
+# 残りの席数の表示 (応募者数はカウンタから読むので数え直さない)
+def seats_label(event):
+    if event.seats_left is None:
+        return ""
+    if event.seats_left > 0:
+        return f" (残り {event.seats_left} 席)"
+    return f" (満席・キャンセル待ち {event.waitlist_count} 人)"
+
+# レビューの集計の表示 (例: ⭐4.2 (12件))
+def review_summary(record):
+    if not record.review_count:
+        return "レビューなし"
+    return f"⭐{record.rating:.1f} ({record.review_count}件)"
+
+# 満足度ごとの件数を横棒で表示する
+def review_histogram(record):
+    counts = record.ratings
+    top = max(counts) or 1
+    return "<br>".join(
+        f"⭐{rating} {'█' * round(10 * count / top)} {count}"
+        for rating, count in reversed(list(enumerate(counts, start=1)))
+    )
 
 # イベント一覧表示
-def display_event_list(groups):
+def display_event_list(snapshot):
+    import catalog  # 列指向テーブル (pandas) はこのタブを開いたときに初めて読み込む
     st.header("イベント一覧")
+    show_apply_error()
 
     # 検索ボックスとカテゴリー選択
     col1, col2 = st.columns([8, 2])
     with col1:
-        search_query = st.text_input("イベント名で検索", "")
+        search_query = st.text_input("キーワードで検索 (イベント名・内容・場所・団体名)", "")
     with col2:
-        category_filter = st.multiselect("ジャンルごとに検索", ["新歓", "勉強会", "交流会", "スポーツ", "ボランティア", "ものづくり系", "旅行", "インターン", "追いコン"], key="category_filter")
-
-    # フィルタリングとソート
-    filtered_groups = []
-    for group in groups:
-        if "events" in group and group["events"]:
-            filtered_events = [
-                event for event in group["events"]
-                if (search_query.lower() in event["title"].lower()) and
-                   (not category_filter or event.get("category") in category_filter)  # カテゴリーフィルタ適用
-            ]
-            if filtered_events:
-                group_copy = group.copy()
-                group_copy["events"] = filtered_events
-                filtered_groups.append(group_copy)
+        category_filter = st.multiselect("ジャンルごとに検索", EVENT_CATEGORIES, key="category_filter")
+    period = st.radio("期間", PERIODS, horizontal=True, key="period")
+
+    # 詳細な絞り込みと並べ替え
+    with st.expander("詳細な絞り込み・並べ替え"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            group_filter = st.multiselect("団体", [group.name for group in snapshot.groups], key="group_filter")
+        with col2:
+            date_range = st.date_input("開催日の範囲", value=(), key="date_range")
+        with col3:
+            min_capacity = st.number_input("募集人数 (以上)", min_value=0, step=1, key="min_capacity")
+        sort = st.selectbox("並べ替え", ["標準"] + list(catalog.SORT_OPTIONS), key="sort")
+
+    # 期間は開催日の索引から二分探索で切り出す (終了したイベントは既定では表示しない)
+    if period == "開催予定":
+        ids = snapshot.dates.upcoming()
+    elif period == "今週":
+        ids = snapshot.dates.between(*dates.this_week())
+    else:
+        ids = None
+    # フィルタリングとソート (列指向テーブルでまとめて行う)
+    if search_query.strip():
+        search_ids = snapshot.search.search(search_query)
+        if ids is not None:
+            in_period = set(ids)
+            search_ids = [event_id for event_id in search_ids if event_id in in_period]  # 関連度の順を保つ
+        ids = search_ids
+    rows = catalog.filter_events(
+        snapshot.catalog,
+        ids=ids,
+        categories=category_filter,  # カテゴリーフィルタ適用
+        groups=group_filter,
+        date_from=date_range[0] if len(date_range) > 0 else None,
+        date_to=date_range[1] if len(date_range) > 1 else None,
+        min_capacity=min_capacity,
+        sort=sort,
+    )
+    # 団体ごとにまとめる (検索時は最も順位の高いイベントを持つ団体から表示)
+    rows = catalog.group_together(rows)
+
+    # ページング (検索条件が変わったら先頭のページから表示し直す)
+    page_size = st.selectbox("表示件数", EVENT_PAGE_SIZES, key="page_size")
+    filter_key = (search_query, period, tuple(category_filter), tuple(group_filter), tuple(date_range), min_capacity, sort)
+    if st.session_state.get("event_list_filter") != filter_key:
+        st.session_state["event_list_filter"] = filter_key
+        st.session_state["event_list_limit"] = page_size
+    limit = max(st.session_state.get("event_list_limit", page_size), page_size)
+    visible_events = [snapshot.events_by_id[event_id] for event_id in rows.index[:limit]]
 
     # イベント表示
-    if filtered_groups:
-        for group_index, group in enumerate(filtered_groups):
+    if visible_events:
+        for (group_name, group_icon), group_events in groupby(visible_events, key=lambda e: (e.group_name, e.group_icon)):
             col1, col2 = st.columns([1, 9])
             with col1: # 団体のアイコンを表示
-                icon_path = group.get("icon") or "data/icons/default_icon.png"
-                if not os.path.exists(icon_path):
-                    st.warning(f"画像が見つかりません: {icon_path}。デフォルト画像を使用します。")
-                    icon_path = "data/icons/default_icon.png"  # デフォルト画像を使用
-
-                st.image(icon_path, width=40)
-            with col2: # 団体名を表示
+                # 縮小済みのサムネイルを送る (メモリにキャッシュされるので毎回ファイルを調べない)
+                icon, found = assets.icon_thumbnail(group_icon)
+                if not found:
+                    st.warning(f"画像が見つかりません: {group_icon}。デフォルト画像を使用します。")
+                st.image(icon, width=40)
+            with col2: # 団体名と団体全体のレビューの集計を表示
                 st.markdown(
-                    f"<h3 style='font-size: 30px;'>{group['name']}</h3>", 
+                    f"<h3 style='font-size: 30px;'>{group_name}</h3>", 
                     unsafe_allow_html=True
                 )
+                st.caption(f"団体の評価: {review_summary(snapshot.groups_by_name[group_name])}")
 
-            if "events" in group and group["events"]:
-                for event_index, event in enumerate(group["events"]):
-                    # セッション状態の初期化
-                    map_key = f"show_map_{group_index}_{event_index}"
-                    if map_key not in st.session_state:
-                        st.session_state[map_key] = False
-
-                    # イベント情報の表示
-                    st.markdown(
-                        f"""
-                        <div style="border: 1px solid #ddd; border-radius: 10px; padding: 15px; margin-bottom: 15px; background-color: #f0f8ff; color: #333;">
-                            <h4 style="color: #333;">🎯 イベント名: {event['title']}</h4>
-                            <p><strong>📍 場所:</strong> <a href="#" id="location_{group_index}_{event_index}" style="color: #007acc; text-decoration: underline;" onclick="window.showMap('{map_key}')">{event.get('location', '未設定')}</a></p>
-                            <p><strong>📅 日時:</strong> {event.get('date', '未設定')}</p>
-                            <p><strong>📝 イベント内容:</strong> {event.get('description', '未設定')}</p>
-                            <p><strong>📊 募集人数:</strong> {event.get('capacity', '未設定')}</p>
-                            <p><strong>🏷️ カテゴリー:</strong> {event.get('category', '未設定')}</p>
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
-                    # 応募フォームを展開するボタン
-                    with st.expander("応募する"):
-                        form_key = f"apply_form_{group_index}_{event_index}"  # インデックスを含めたキー
-                        with st.form(form_key):
-                            name = st.text_input("名前を入力してください", key=f"name_{group_index}_{event_index}")
-                            email = st.text_input("メールアドレスを入力してください", key=f"email_{group_index}_{event_index}")
-                            submitted = st.form_submit_button("送信")
-                            if submitted:
-                                if name and email: #応募機能
-                                    if "applicants" not in event:
-                                        event["applicants"] = []
-                                    event["applicants"].append({"name": name, "email": email})
-                                    save_data(groups)
-                                    st.success(f"{name} さんがイベント '{event['title']}' に応募しました！")
-                                else:
-                                    st.error("名前とメールアドレスを入力してください。")
-
-                    # 地図の表示
-                    show_map = st.checkbox("地図を見る", key=f"map_checkbox_{group_index}_{event_index}", value=st.session_state.get(map_key, False))
-                    st.session_state[map_key] = show_map
-
-                    if st.session_state[map_key]:
-                        st.map(pd.DataFrame([{
-                            "lat": event["latitude"],
-                            "lon": event["longitude"]
-                        }]))
-
-                    # レビュー表示
-                    if "reviews" in event:
-                        st.markdown(
-                            "<h4 style='font-size: 18px;'>✒️レビュー</h4>",
-                            unsafe_allow_html=True
-                            )
-                        for review in event["reviews"]:
-                            st.markdown(
-                                f"""
-                                <div style="border: 1px solid #ddd; border-radius: 10px; padding: 15px; margin-bottom: 15px; background-color: #ffffe0;">
-                                    <strong>【満足度】</strong> ⭐{review['satisfaction']} / ⭐5 <br>
-                                    <strong>【感想】</strong> {review['feedback']}
-                                </div>
-                                """,
-                                unsafe_allow_html=True
-                            )
-                        # レビューの後に空白を挿入
-                        st.markdown("<div style='height: 5px;'></div>", unsafe_allow_html=True)
+            for event in group_events:
+                event_card(event.id)
 
             # 団体間に空白行を追加
             st.markdown("<hr style='border: none; height: 5px;'>", unsafe_allow_html=True)
+
+        # 続きを読み込む
+        st.caption(f"{len(rows)} 件中 {len(visible_events)} 件を表示中")
+        if len(rows) > limit:
+            st.button("もっと見る", on_click=set_state, args=("event_list_limit", limit + page_size))
     else:
         st.markdown("<p style='color: gray;'>該当するイベントが見つかりません。</p>", unsafe_allow_html=True)
 
+# イベントのカード (フラグメント)
+# 応募・地図・レビューの操作ではこのカードだけを再実行し、ページ全体は描画し直さない
+@st.fragment
+@metrics.timed("fragment.event_card")
+def event_card(event_id):
+    event = get_snapshot().events_by_id.get(event_id)  # 応募やレビューの反映は差分の読み込みだけで済む
+    if event is None:
+        return
+    # セッション状態の初期化
+    map_key = f"show_map_{event_id}"
+    if map_key not in st.session_state:
+        st.session_state[map_key] = False
+
+    # イベント情報の表示
+    st.markdown(
+        f"""
+        <div style="border: 1px solid #ddd; border-radius: 10px; padding: 15px; margin-bottom: 15px; background-color: #f0f8ff; color: #333;">
+            <h4 style="color: #333;">🎯 イベント名: {event.title}</h4>
+            <p><strong>📍 場所:</strong> <a href="#" id="location_{event_id}" style="color: #007acc; text-decoration: underline;" onclick="window.showMap('{map_key}')">{event.location or '未設定'}</a></p>
+            <p><strong>📅 日時:</strong> {event.date or '未設定'}</p>
+            <p><strong>📝 イベント内容:</strong> {event.description or '未設定'}</p>
+            <p><strong>📊 募集人数:</strong> {event.capacity or '未設定'}{seats_label(event)}</p>
+            <p><strong>🏷️ カテゴリー:</strong> {event.category or '未設定'}</p>
+            <p><strong>✒️ 評価:</strong> {review_summary(event)}</p>
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+    # 応募フォームは開いたイベントだけ作る (閉じているイベントのウィジェットは送らない)
+    if st.checkbox("キャンセル待ちに登録する" if event.seats_left == 0 else "応募する", key=f"apply_open_{event_id}"):
+        form_key = f"apply_form_{event_id}"  # イベントIDを含めたキー
+        with st.form(form_key):
+            st.text_input("名前を入力してください", key=f"name_{event_id}")
+            st.text_input("メールアドレスを入力してください", key=f"email_{event_id}")
+            st.form_submit_button("送信", on_click=apply_for_event, args=(event_id, event.title))
+        result = st.session_state.pop(f"apply_result_{event_id}", None)
+        if result:
+            getattr(st, result[0])(result[1])
+
+    # 地図の表示
+    show_map = st.checkbox("地図を見る", key=f"map_checkbox_{event_id}", value=st.session_state.get(map_key, False))
+    st.session_state[map_key] = show_map
+
+    if st.session_state[map_key]:
+        import pandas as pd
+        st.map(pd.DataFrame([{
+            "lat": event.latitude,
+            "lon": event.longitude
+        }]))
+
+    # レビュー表示 (開いたときに集計を表示し、本文は REVIEW_PAGE_SIZE 件ずつ読み込む)
+    if event.review_count and st.checkbox("レビューを見る", key=f"reviews_open_{event_id}"):
+        st.markdown(
+            "<h4 style='font-size: 18px;'>✒️レビュー</h4>",
+            unsafe_allow_html=True
+            )
+        st.markdown(
+            f"<p>{review_summary(event)}<br>{review_histogram(event)}</p>",
+            unsafe_allow_html=True
+        )
+        limit_key = f"reviews_limit_{event_id}"
+        review_limit = st.session_state.get(limit_key, REVIEW_PAGE_SIZE)
+        for review in storage.list_reviews(event_id, limit=review_limit):
+            st.markdown(
+                f"""
+                <div style="border: 1px solid #ddd; border-radius: 10px; padding: 15px; margin-bottom: 15px; background-color: #ffffe0;">
+                    <strong>【満足度】</strong> ⭐{review.satisfaction} / ⭐5 <br>
+                    <strong>【感想】</strong> {review.feedback}
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
+        if event.review_count > review_limit:
+            st.button("さらにレビューを見る", key=f"reviews_more_{event_id}",
+                      on_click=set_state, args=(limit_key, review_limit + REVIEW_PAGE_SIZE))
+        # レビューの後に空白を挿入
+        st.markdown("<div style='height: 5px;'></div>", unsafe_allow_html=True)
+
 # サークル追加フォーム
-def add_group_form(groups):
+def add_group_form(snapshot):
     st.subheader("サークルを追加する")
     with st.form("add_group_form"):
         new_group_name = st.text_input("新しいサークル名")
@@ -162,26 +324,33 @@ def add_group_form(groups):
 
         if group_submitted:
             if new_group_name and group_password:
-                if any(group["name"] == new_group_name for group in groups):
+                # アップロードされた画像は保存する前に1回だけ読み込んで確認する
+                try:
+                    icon = assets.load_upload(icon_file) if icon_file else None
+                except assets.InvalidImage as e:
+                    st.error(str(e))
+                    return
+                icon_path = assets.icon_path(new_group_name) if icon else None
+                try:
+                    hashed = auth.hash_password(group_password) if new_group_name not in snapshot.groups_by_name else None  # ハッシュ化
+                except auth.LoginRejected as e:
+                    st.error(str(e))
+                    return
+                # 名前の重複は DB の一意制約で確認する (同時に登録されても二重にならない)
+                if hashed is None or storage.add_group(new_group_name, hashed, icon_path) is None:
                     st.error(f"サークル '{new_group_name}' は既に存在します。")
                 else:
-                    icon_path = save_icon(icon_file, new_group_name) if icon_file else None
-                    groups.append({
-                        "name": new_group_name,
-                        "password": hash_password(group_password),  # ハッシュ化
-                        "events": [],
-                        "icon": icon_path
-                    })
-                    save_data(groups)
+                    if icon:
+                        assets.save_icon(icon, new_group_name)
                     st.success(f"サークル '{new_group_name}' を追加しました！")
             else:
                 st.error("サークル名とパスワードを入力してください。")
 
 # イベント追加フォーム
-def add_event_form(groups):
+def add_event_form(snapshot):
     st.subheader("イベントを追加する")
     with st.form("add_event_form"):
-        group_name = st.selectbox("団体名", [group["name"] for group in groups] if groups else [])
+        group_name = st.selectbox("団体名", [group.name for group in snapshot.groups])
         event_title = st.text_input("イベント名")
         event_date = st.date_input("開催日時")
         event_location_name = st.text_input("イベントの場所 (地名)", placeholder="例: 東京タワー")
@@ -192,25 +361,22 @@ def add_event_form(groups):
         if submitted:
             if group_name and event_title and event_description and event_date and event_location_name:
                 try:
-                    # geopyを使用して地名から緯度・経度を取得
-                    geolocator = Nominatim(user_agent="student-groups-app")
-                    location = geolocator.geocode(event_location_name)
+                    # 地名から緯度・経度を取得 (キャッシュ済みなら問い合わせない)
+                    location = geocoding.geocode(event_location_name)
                     if location:
-                        lat, lon = location.latitude, location.longitude
-                        for group in groups:
-                            if group["name"] == group_name:
-                                group["events"].append({
-                                    "title": event_title,
-                                    "description": event_description,
-                                    "date": str(event_date),
-                                    "location": event_location_name,
-                                    "latitude": lat, # 緯度
-                                    "longitude": lon, # 経度
-                                    "capacity": event_capacity
-                                })
-                                save_data(groups)
-                                st.success(f"イベント '{event_title}' を団体 '{group_name}' に登録しました！")
-                                break
+                        lat, lon = location
+                        group = snapshot.groups_by_name.get(group_name)
+                        if group:
+                            storage.add_event(group.id, {
+                                "title": event_title,
+                                "description": event_description,
+                                "date": str(event_date),
+                                "location": event_location_name,
+                                "latitude": lat, # 緯度
+                                "longitude": lon, # 経度
+                                "capacity": event_capacity
+                            })
+                            st.success(f"イベント '{event_title}' を団体 '{group_name}' に登録しました！")
                     else:
                         st.error("指定された地名から緯度・経度を取得できませんでした。正しい地名を入力してください。")
                 except Exception as e:
@@ -220,208 +386,341 @@ def add_event_form(groups):
 
 # イベントマップ表示
 # イベント情報を地図上にマッピングする
-def display_map(groups):
+def display_map(snapshot):
+    import pandas as pd
     st.header("イベントマップ")
-    map_data = []
-    for group in groups:
-        if "events" in group and group["events"]:
-            for event in group["events"]:
-                if "latitude" in event and "longitude" in event:
-                    map_data.append({
-                        "lat": event["latitude"],
-                        "lon": event["longitude"],
-                        "event": event["title"],
-                        "group": group["name"]
-                    })
+
+    # 表示範囲の指定 (地名を入れるとその周辺のイベントだけを送る)
+    col1, col2, col3 = st.columns([5, 3, 2])
+    with col1:
+        center_name = st.text_input("中心の地名 (空欄で全体を表示)", placeholder="例: 東京駅")
+    with col2:
+        category_filter = st.multiselect("ジャンル", EVENT_CATEGORIES, key="map_category_filter")
+    with col3:
+        radius_km = st.slider("半径 (km)", 1, 50, 5)
+    category_ids = set().union(*(snapshot.categories.events(category) for category in category_filter)) if category_filter else None
+
+    zoom = None
+    nearby = []
+    if center_name:
+        try:
+            center = geocoding.geocode(center_name)
+        except Exception as e:
+            st.error(f"エラーが発生しました: {e}")
+            return
+        if not center:
+            st.error("指定された地名から緯度・経度を取得できませんでした。正しい地名を入力してください。")
+            return
+        nearby = snapshot.spatial.query_radius(center[0], center[1], radius_km)
+        if category_ids is not None:
+            nearby = [(distance, event_id) for distance, event_id in nearby if event_id in category_ids]
+        event_ids = [event_id for _, event_id in nearby]
+        zoom = max(1, min(16, round(14 - math.log2(radius_km))))
+    else:
+        event_ids = list(category_ids) if category_ids is not None else list(snapshot.events_by_id)
+
+    # 点が多いときは近くの点をまとめ、件数に応じた大きさの円で表示する
+    map_data = snapshot.spatial.cluster(event_ids, max_points=MAX_MAP_POINTS)
     if map_data:
         df = pd.DataFrame(map_data)
-        st.map(df)
+        if len(df) < len(event_ids):
+            df["size"] = df["count"].map(lambda count: 100 * math.sqrt(count))
+            st.caption(f"{len(event_ids)} 件のイベントを {len(df)} か所にまとめて表示しています。")
+            st.map(df, size="size", zoom=zoom)
+        else:
+            st.map(df, zoom=zoom)
     else:
         st.write("現在、地図に表示できるイベントはありません。")
 
+    # 周辺のイベント一覧
+    if nearby:
+        st.subheader(f"{center_name} から {radius_km} km 以内のイベント")
+        st.dataframe(pd.DataFrame([
+            {
+                "イベント名": snapshot.events_by_id[event_id].title,
+                "団体名": snapshot.events_by_id[event_id].group_name,
+                "日時": snapshot.events_by_id[event_id].date,
+                "距離 (km)": round(distance, 2),
+            }
+            for distance, event_id in nearby if event_id in snapshot.events_by_id
+        ]), hide_index=True)
+
+# ログイン状態のトークンはクッキーにも持たせる
+# (再接続で別のワーカーに振り分けられると session_state は新しくなるので、接続時に送られてくるクッキーから復元する。
+#  URL に載せると、リンクの共有・閲覧履歴・アクセスログからトークンが漏れる)
+SESSION_COOKIE = "rally_session"
+
+def session_token():
+    # クッキーは接続時のものなので、セッションごとに1回だけ読む (ログアウト後に古いクッキーから復元しない)
+    if "auth_token" not in st.session_state and not st.session_state.get("session_cookie_read"):
+        st.session_state["session_cookie_read"] = True
+        token = st.context.cookies.to_dict().get(SESSION_COOKIE)
+        if token:
+            st.session_state["auth_token"] = token
+    return st.session_state.get("auth_token")
+
+# クッキーの書き込み (token が None なら削除する)
+# Streamlit からはクッキーを設定できないので、ブラウザ側のスクリプトで書き込む。コールバックの中では描画できないので、
+# 書き込む内容を session_state に置いておき、次の描画で write_session_cookie() が送る
+def set_session_cookie(token):
+    st.session_state["session_cookie"] = token or ""
+
+def write_session_cookie():
+    if "session_cookie" not in st.session_state:
+        return
+    token = st.session_state.pop("session_cookie")
+    max_age = auth.SESSION_TTL if token else 0
+    st.html(
+        f"<script>document.cookie = {json.dumps(f'{SESSION_COOKIE}={token}; Path=/; Max-Age={max_age}; SameSite=Strict')}"
+        ' + (location.protocol === "https:" ? "; Secure" : "");</script>',
+        unsafe_allow_javascript=True,
+    )
+
+# サークル管理者画面のボタンの処理 (コールバック)
+# 書き込みは再実行の前に済ませ、結果はメッセージとして次の描画で表示する
+def admin_login():
+    group_name = st.session_state.get("admin_group")
+    group = storage.get_group(group_name)
+    try:
+        token = auth.login(group_name, st.session_state.get("admin_password", ""), group.password if group else None, client_id())  # ハッシュを比較
+    except auth.LoginRejected as e:
+        st.session_state["admin_error"] = str(e)
+        return
+    st.session_state["admin_password"] = ""
+    if token:
+        st.session_state["auth_token"] = token # セッションを更新してログイン状態にする
+        set_session_cookie(token)
+        st.session_state["admin_message"] = f"サークル '{group_name}' の管理画面にアクセスしました！"
+    else:
+        st.session_state["admin_error"] = "パスワードが間違っています。"
+
+def admin_logout():
+    auth.logout(st.session_state.pop("auth_token", None))
+    set_session_cookie(None)
+
+def admin_delete_event(group_id, event_id):
+    event = storage.get_event(event_id)
+    if event and event.group_id == group_id:
+        storage.delete_event(event.id)
+        st.session_state["admin_message"] = f"イベント '{event.title}' を削除しました！"
+
+def admin_remove_applicant(group_id, event_id, email):
+    event = storage.get_event(event_id)
+    if event and event.group_id == group_id:
+        promoted = storage.remove_applicant(event_id, email)
+        if promoted is not None:
+            message = f"{email} さんの応募を取り消しました。"
+            if promoted:
+                message += f" キャンセル待ちから {', '.join(applicant.name for applicant in promoted)} さんが繰り上がりました。"
+            st.session_state["admin_message"] = message
+
+def admin_update_event(event):
+    state = st.session_state
+    new_title = state[f"edit_title_{event.id}"]
+    new_location = state[f"edit_location_{event.id}"]
+    try:
+        # 場所が変更された場合だけ新しい場所の座標を取得
+        location = geocoding.geocode_if_changed(new_location, event)
+        if location:
+            lat, lon = location
+            new_date = state[f"edit_date_{event.id}"]
+            # イベント情報を更新
+            storage.update_event(event.id, {
+                "title": new_title,
+                "date": str(new_date) if new_date else None,
+                "location": new_location,
+                "description": state[f"edit_description_{event.id}"],
+                "capacity": state[f"edit_capacity_{event.id}"],
+                "latitude": lat,
+                "longitude": lon
+            })
+            state["admin_message"] = f"イベント '{new_title}' を更新しました！"
+        else:
+            state["admin_error"] = "指定された地名から緯度・経度を取得できませんでした。正しい地名を入力してください。"
+    except Exception as e:
+        state["admin_error"] = f"エラーが発生しました: {e}"
+
+def admin_add_event(group_id, group_name):
+    state = st.session_state
+    event_title = state["new_event_title"]
+    event_date = state["new_event_date"]
+    event_location_name = state["new_event_location"]
+    event_description = state["new_event_description"]
+    if not (event_title and event_description and event_date and event_location_name):
+        state["admin_error"] = "すべての項目を入力してください。"
+        return
+    try:
+        location = geocoding.geocode(event_location_name)
+        if location:
+            lat, lon = location
+            storage.add_event(group_id, {
+                "title": event_title,
+                "description": event_description,
+                "date": str(event_date),
+                "location": event_location_name,
+                "latitude": lat,
+                "longitude": lon,
+                "capacity": state["new_event_capacity"],
+                "category": state["new_event_category"]
+            })
+            state["admin_message"] = f"イベント '{event_title}' を団体 '{group_name}' に登録しました！"
+        else:
+            state["admin_error"] = "指定された地名から緯度・経度を取得できませんでした。正しい地名を入力してください。"
+    except Exception as e:
+        state["admin_error"] = f"エラーが発生しました: {e}"
+
+def show_admin_messages():
+    if "admin_message" in st.session_state:
+        st.success(st.session_state.pop("admin_message"))
+    if "admin_error" in st.session_state:
+        st.error(st.session_state.pop("admin_error"))
+
 # サークル管理者画面
-def admin_panel(groups):
+def admin_panel(snapshot):
     st.header("管理者画面")
 
-    # セッションに初期値がなければ初期化
-    if "authenticated_group" not in st.session_state:
-        st.session_state["authenticated_group"] = None
-        st.session_state["authenticated"] = False
+    # ログイン状態はセッショントークンで確認する (再実行のたびにパスワードを照合しない)
+    authenticated_group = auth.session_group(session_token())
+    if authenticated_group is None and "auth_token" in st.session_state:
+        # 期限切れ・ログアウト済みのトークンは捨てる
+        del st.session_state["auth_token"]
+        set_session_cookie(None)
+    write_session_cookie()
 
-    if not st.session_state["authenticated"]:
-        selected_group = st.selectbox("管理するサークルを選択してください", [group["name"] for group in groups])
-        password_input = st.text_input("パスワードを入力してください", type="password")
+    if authenticated_group is None:
+        st.selectbox("管理するサークルを選択してください", [group.name for group in snapshot.groups], key="admin_group")
+        st.text_input("パスワードを入力してください", type="password", key="admin_password")
 
         # ログイン処理
-        if st.button("認証"):
-            group = next((g for g in groups if g["name"] == selected_group), None)
-            if group and check_password(password_input, group["password"]):  # ハッシュを比較
-                st.session_state["authenticated_group"] = selected_group
-                st.session_state["authenticated"] = True # セッションを更新してログイン状態にする
-                st.success(f"サークル '{selected_group}' の管理画面にアクセスしました！")
-                st.rerun()
-            else:
-                st.error("パスワードが間違っています。")
+        st.button("認証", on_click=admin_login)
+        show_admin_messages()
     else:
         # ログイン済みのグループ名を取得
-        selected_group = st.session_state["authenticated_group"]
-        group = next((g for g in groups if g["name"] == selected_group), None)
+        selected_group = authenticated_group
+        group = snapshot.groups_by_name.get(selected_group)
         st.success(f"サークル '{selected_group}' の管理画面にアクセス中")
+        show_admin_messages()
 
         # イベント一覧セクション
         st.subheader("登録済みのイベント")
-        if group and "events" in group and group["events"]:
-            for event_index, event in enumerate(group["events"]):
+        events = snapshot.events_by_group.get(group.id, ()) if group else ()
+        if events:
+            for event in events:
                 with st.container():
-                    st.markdown(f"### 🎯 イベント名: {event['title']}")
-                    st.markdown(f"- 📅 開催日時: {event.get('date', '未設定')}")
-                    st.markdown(f"- 📍 場所: {event.get('location', '未設定')}")
-                    st.markdown(f"- 📝 内容: {event.get('description', '未設定')}")
-                    st.markdown(f"- 📊 募集人数: {event.get('capacity', '未設定')}")
-                    st.markdown(f"- 🏷️ カテゴリー: {event.get('category', '未設定')}")
-
-                    # 応募者リスト
-                    if "applicants" in event and event["applicants"]:
-                        st.markdown("#### 応募者リスト:")
-                        for applicant in event["applicants"]:
-                            st.markdown(f"- 名前: {applicant['name']}, メール: {applicant['email']}")
+                    st.markdown(f"### 🎯 イベント名: {event.title}")
+                    st.markdown(f"- 📅 開催日時: {event.date or '未設定'}")
+                    st.markdown(f"- 📍 場所: {event.location or '未設定'}")
+                    st.markdown(f"- 📝 内容: {event.description or '未設定'}")
+                    st.markdown(f"- 📊 募集人数: {event.capacity or '未設定'}")
+                    st.markdown(f"- 🏷️ カテゴリー: {event.category or '未設定'}")
+
+                    # 応募者リスト (取り消すとキャンセル待ちが繰り上がる)
+                    applicants = storage.list_applicants(event.id)
+                    if applicants:
+                        st.markdown(f"#### 応募者リスト ({event.applicant_count} / {event.capacity or '-'} 人):")
+                        for applicant in applicants:
+                            col1, col2 = st.columns([8, 2])
+                            with col1:
+                                st.markdown(f"- 名前: {applicant.name}, メール: {applicant.email}")
+                            with col2:
+                                st.button("取り消す", key=f"remove_{event.id}_{applicant.email}",
+                                          on_click=admin_remove_applicant, args=(group.id, event.id, applicant.email))
                     else:
                         st.markdown("- 応募者なし")
+                    if event.waitlist_count:
+                        st.markdown("#### キャンセル待ち (先着順):")
+                        for position, applicant in enumerate(storage.list_waitlist(event.id), start=1):
+                            st.markdown(f"{position}. 名前: {applicant.name}, メール: {applicant.email}")
 
                     # 削除ボタン
-                    if st.button(f"イベントを削除 ({event['title']})", key=f"delete_{group['name']}_{event_index}"):
-                        st.session_state["delete_event"] = {
-                            "group_name": group["name"],
-                            "event_index": event_index
-                        }
-                        st.rerun()
+                    st.button(f"イベントを削除 ({event.title})", key=f"delete_{event.id}",
+                              on_click=admin_delete_event, args=(group.id, event.id))
 
                     # 編集フォームを展開するための expander
-                    with st.expander(f"編集 ({event['title']})"):
-                        with st.form(f"edit_event_form_{event_index}"):
-                            new_title = st.text_input("イベント名", value=event["title"])
-                            new_date = st.date_input("開催日時", value=pd.to_datetime(event["date"]))
-                            new_location = st.text_input("イベントの場所", value=event.get("location", ""))
-                            new_description = st.text_area("イベント内容", value=event.get("description", ""))
-                            new_capacity = st.number_input("募集人数", min_value=1, step=1, value=event.get("capacity", 1))
-                            submitted = st.form_submit_button("保存")
-
-                            if submitted:
-                                try:
-                                    # 更新された場所をもとに新しい場所の座標を取得
-                                    geolocator = Nominatim(user_agent="student-groups-app")
-                                    location = geolocator.geocode(new_location)
-                                    if location:
-                                        lat, lon = location.latitude, location.longitude
-                                        # イベント情報を更新
-                                        event["title"] = new_title
-                                        event["date"] = str(new_date)
-                                        event["location"] = new_location
-                                        event["description"] = new_description
-                                        event["capacity"] = new_capacity
-                                        event["latitude"] = lat
-                                        event["longitude"] = lon
-                                        save_data(groups)
-                                        st.success(f"イベント '{new_title}' を更新しました！")
-                                        st.rerun()
-                                    else:
-                                        st.error("指定された地名から緯度・経度を取得できませんでした。正しい地名を入力してください。")
-                                except Exception as e:
-                                    st.error(f"エラーが発生しました: {e}")
-
-            # 削除処理（rerun後）
-            if "delete_event" in st.session_state:
-                to_delete = st.session_state.pop("delete_event")
-                if to_delete["group_name"] == group["name"]:
-                    if 0 <= to_delete["event_index"] < len(group["events"]):
-                        deleted_event = group["events"].pop(to_delete["event_index"])
-                        save_data(groups)
-                        st.success(f"イベント '{deleted_event['title']}' を削除しました！")
-                        st.rerun()
+                    with st.expander(f"編集 ({event.title})"):
+                        with st.form(f"edit_event_form_{event.id}"):
+                            st.text_input("イベント名", value=event.title, key=f"edit_title_{event.id}")
+                            st.date_input("開催日時", value=date.fromisoformat(event.date) if event.date else None, key=f"edit_date_{event.id}")  # 日付のないイベントもある
+                            st.text_input("イベントの場所", value=event.location or "", key=f"edit_location_{event.id}")
+                            st.text_area("イベント内容", value=event.description or "", key=f"edit_description_{event.id}")
+                            st.number_input("募集人数", min_value=1, step=1, value=event.capacity or 1, key=f"edit_capacity_{event.id}")
+                            st.form_submit_button("保存", on_click=admin_update_event, args=(event,))
         else:
             st.markdown("- イベントなし")
 
         # イベント追加セクション
         st.subheader("イベントを追加する")
         with st.form("add_event_form"):
-            event_title = st.text_input("イベント名")
-            event_date = st.date_input("開催日時")
-            event_location_name = st.text_input("イベントの場所 (地名)", placeholder="例: 東京タワー")
-            event_description = st.text_area("イベント内容")
-            event_capacity = st.number_input("募集人数", min_value=1, step=1)
-            event_category = st.selectbox("カテゴリー", ["新歓", "勉強会", "交流会", "スポーツ", "ボランティア", "ものづくり系", "旅行", "インターン", "追いコン"])  # カテゴリー選択
-            submitted = st.form_submit_button("登録")
-
-            if submitted:
-                if event_title and event_description and event_date and event_location_name:
-                    try:
-                        geolocator = Nominatim(user_agent="student-groups-app")
-                        location = geolocator.geocode(event_location_name)
-                        if location:
-                            lat, lon = location.latitude, location.longitude
-                            group["events"].append({
-                                "title": event_title,
-                                "description": event_description,
-                                "date": str(event_date),
-                                "location": event_location_name,
-                                "latitude": lat,
-                                "longitude": lon,
-                                "capacity": event_capacity,
-                                "category": event_category 
-                            })
-                            save_data(groups)
-                            st.success(f"イベント '{event_title}' を団体 '{selected_group}' に登録しました！")
-                        else:
-                            st.error("指定された地名から緯度・経度を取得できませんでした。正しい地名を入力してください。")
-                    except Exception as e:
-                        st.error(f"エラーが発生しました: {e}")
-                else:
-                    st.error("すべての項目を入力してください。")
+            st.text_input("イベント名", key="new_event_title")
+            st.date_input("開催日時", key="new_event_date")
+            st.text_input("イベントの場所 (地名)", placeholder="例: 東京タワー", key="new_event_location")
+            st.text_area("イベント内容", key="new_event_description")
+            st.number_input("募集人数", min_value=1, step=1, key="new_event_capacity")
+            st.selectbox("カテゴリー", EVENT_CATEGORIES, key="new_event_category")  # カテゴリー選択
+            st.form_submit_button("登録", on_click=admin_add_event, args=(group.id, selected_group))
 
         # ログアウトボタン
-        if st.button("ログアウト"):
-            st.session_state["authenticated"] = False
-            st.session_state["authenticated_group"] = None
-            st.rerun()
+        st.button("ログアウト", on_click=admin_logout)
+
+# ジャンル選択ページ
+# ジャンルごとの件数とイベントはカテゴリーの索引から引くので、全イベントを調べ直さない
+def genre_selection_page(snapshot):
+    genre = st.session_state.get("selected_genre")
+    today = dates.today()
+    if genre:
+        genre_events(snapshot, genre, today)
+        return
 
-# ジャンル選択ページ(クリックして検索までは実装できなかった)
-def genre_selection_page():
     st.header("ジャンルを選択してください")
-
-    # ジャンルリスト
-    genres = [
-        {"name": "新歓", "image": "data/images/shinkan.jpg"},
-        {"name": "勉強会", "image": "data/images/study.jpeg"},
-        {"name": "交流会", "image": "data/images/networking.jpg"},
-        {"name": "スポーツ", "image": "data/images/sports.jpg"},
-        {"name": "ボランティア", "image": "data/images/volunteer.jpg"},
-        {"name": "ものづくり系", "image": "data/images/creation.jpeg"},
-        {"name": "旅行", "image": "data/images/travel.jpg"},
-        {"name": "インターン", "image": "data/images/internship.jpg"},
-        {"name": "追いコン", "image": "data/images/farewell.jpg"},
-    ]
+    counts = snapshot.categories.counts(since=today)  # 開催予定のイベントの件数
 
     # グリッド形式でジャンルを表示
     cols = st.columns(3)  # 3列のグリッドを作成
-    for index, genre in enumerate(genres):
+    for index, (name, image_path) in enumerate(GENRES):
         with cols[index % 3]:  # 各列に順番に配置
-            image_path = genre["image"]
-            if os.path.exists(image_path):  # ファイルが存在するか確認
-                st.image(image_path, caption=genre["name"])
+            image = assets.thumbnail(image_path, assets.GENRE_THUMB_SIZE)  # 縮小済みの画像 (見つからなければ None)
+            if image is not None:
+                st.image(image)
             else:
                 st.error(f"画像が見つかりません: {image_path}")
+            st.button(f"{name} ({counts.get(name, 0)} 件)", key=f"genre_{name}", on_click=open_genre, args=(name,))
+
+# ジャンルを開く (コールバック): 先頭のページから表示する
+def open_genre(genre):
+    st.session_state["selected_genre"] = genre
+    st.session_state["genre_limit"] = EVENT_PAGE_SIZES[0]
+
+# ジャンルのイベント一覧 (開催日の順。過去のイベントは選んだときだけ表示する)
+def genre_events(snapshot, genre, today):
+    st.button("← ジャンル一覧に戻る", on_click=set_state, args=("selected_genre", None))
+    st.header(f"ジャンル: {genre}")
+    show_apply_error()
+    show_past = st.checkbox("終了したイベントも表示する", key="genre_show_past")
+    event_ids = snapshot.categories.events(genre, since=None if show_past else today)
+    if not event_ids:
+        st.markdown("<p style='color: gray;'>開催予定のイベントはありません。</p>", unsafe_allow_html=True)
+        return
+
+    # ページング
+    page_size = EVENT_PAGE_SIZES[0]
+    limit = st.session_state.get("genre_limit", page_size)
+    for event_id in event_ids[:limit]:
+        event = snapshot.events_by_id.get(event_id)
+        if event is None:  # 表示中に削除されたイベントは飛ばす
+            continue
+        st.caption(event.group_name)
+        event_card(event_id)
+    st.caption(f"{len(event_ids)} 件中 {min(limit, len(event_ids))} 件を表示中")
+    if len(event_ids) > limit:
+        st.button("もっと見る", key="genre_more", on_click=set_state, args=("genre_limit", limit + page_size))
 
 
 # レビュー投稿ページ
-def review_page(groups):
+def review_page(snapshot):
     st.header("レビューを書く")
 
     # イベント選択
-    event_options = [
-        (group["name"], event["title"])
-        for group in groups if "events" in group and group["events"]
-        for event in group["events"]
-    ]
+    event_options = [(event.id, event.group_name, event.title) for event in snapshot.events]
     if not event_options:
         st.info("現在、レビュー可能なイベントはありません。")
         return
@@ -429,7 +728,7 @@ def review_page(groups):
     selected_event = st.selectbox(
         "レビューするイベントを選択してください",
         options=event_options,
-        format_func=lambda x: f"{x[0]} - {x[1]}"
+        format_func=lambda x: f"{x[1]} - {x[2]}"
     )
 
     # ユーザー入力
@@ -442,111 +741,151 @@ def review_page(groups):
         st.session_state.auth_success = False
 
     if st.button("認証"):
-        group_name, event_title = selected_event
-        group_index = next((i for i, g in enumerate(groups) if g["name"] == group_name), None)
-
-        if group_index is not None:
-            event_index = next((j for j, e in enumerate(groups[group_index]["events"]) if e["title"] == event_title), None)
-
-            if event_index is not None:
-                event = groups[group_index]["events"][event_index]
-                if "applicants" in event and any(app["email"] == user_email and app["name"] == user_name for app in event["applicants"]):
-                    st.session_state.auth_success = True
-                    st.session_state.group_index = group_index
-                    st.session_state.event_index = event_index
-                    st.session_state.user_name = user_name
-                    st.session_state.user_email = user_email
-                    st.success("認証に成功しました！")
-                else:
-                    st.error("応募者リストに存在しません。正しい名前とメールアドレスを入力してください。")
+        event_id = selected_event[0]
+        event = snapshot.events_by_id.get(event_id)
+
+        if event is not None:
+            applicant = storage.get_applicant(event_id, user_email)
+            if applicant and applicant.name == user_name:
+                st.session_state.auth_success = True
+                st.session_state.event_id = event_id
+                st.session_state.user_name = user_name
+                st.session_state.user_email = user_email
+                st.success("認証に成功しました！")
             else:
-                st.error("イベントが見つかりません。")
+                st.error("応募者リストに存在しません。正しい名前とメールアドレスを入力してください。")
         else:
-            st.error("グループが見つかりません。")
+            st.error("イベントが見つかりません。")
 
     # 認証後のレビュー投稿画面
     if st.session_state.get("auth_success"):
-        group_index = st.session_state.group_index
-        event_index = st.session_state.event_index
-        event = groups[group_index]["events"][event_index]
+        event_id = st.session_state.event_id
         user_email = st.session_state.user_email
         user_name = st.session_state.user_name
 
-        if "reviews" in event and any(review["email"] == user_email for review in event["reviews"]):
+        if storage.has_review(event_id, user_email):
             st.info("このイベントにはすでにレビューを投稿済みです。")
         else:
             st.subheader("レビューを書く")
-            with st.form(f"review_form_{group_index}_{event_index}"):
+            with st.form(f"review_form_{event_id}"):
                 satisfaction = st.slider("満足度 (⭐1-⭐5)", 1, 5)
                 feedback = st.text_area("感想")
                 review_submitted = st.form_submit_button("レビューを送信")
                 if review_submitted:
-                    if "reviews" not in groups[group_index]["events"][event_index]:
-                        groups[group_index]["events"][event_index]["reviews"] = []
-
-                    groups[group_index]["events"][event_index]["reviews"].append({
-                        "name": user_name,
-                        "email": user_email,
-                        "satisfaction": satisfaction,
-                        "feedback": feedback
-                    })
-                    save_data(groups)
-                    st.success("レビューを送信しました！")
+                    status = storage.add_review(event_id, user_name, user_email, satisfaction, feedback)
+                    if status == storage.ADDED:
+                        st.success("レビューを送信しました！")
+                    elif status == storage.NOT_FOUND:
+                        st.error("イベントが見つかりません。削除されたか、終了して保管された可能性があります。")
+                    else:
+                        st.info("このイベントにはすでにレビューを投稿済みです。")
                     st.session_state.auth_success = False  # 認証セッションを終了
 
+# パフォーマンスのタブ (処理ごとの時間の分位点と回数。パスワードで保護する)
+def dashboard_login():
+    try:
+        ok = auth.check_dashboard_password(st.session_state.get("dashboard_password", ""), client_id())
+    except auth.LoginRejected as e:
+        st.session_state["dashboard_error"] = str(e)
+        return
+    st.session_state["dashboard_password"] = ""
+    if ok:
+        st.session_state["dashboard_authenticated"] = True
+    else:
+        st.session_state["dashboard_error"] = "パスワードが間違っています。"
+
+def performance_page():
+    st.header("パフォーマンス")
+    if auth.DASHBOARD_PASSWORD is None:
+        st.info("環境変数 RALLY_DASHBOARD_PASSWORD を設定すると表示できます。")
+        return
+    if not st.session_state.get("dashboard_authenticated"):
+        st.text_input("パスワードを入力してください", type="password", key="dashboard_password")
+        st.button("表示する", on_click=dashboard_login)
+        if "dashboard_error" in st.session_state:
+            st.error(st.session_state.pop("dashboard_error"))
+        return
+    if not metrics.ENABLED:
+        st.info("計測は無効です。環境変数 RALLY_METRICS=1 を設定して起動してください。")
+
+    import pandas as pd
+    import plotly.graph_objects as go  # このタブを開いたときだけ読み込む
+
+    timings = metrics.timings()
+    if timings:
+        # 処理ごとの分位点 (ミリ秒)
+        names = list(timings)
+        figure = go.Figure([
+            go.Bar(name=quantile, x=names, y=[(timings[name][quantile] or 0) * 1000 for name in names])
+            for quantile in ("p50", "p90", "p99")
+        ])
+        figure.update_layout(barmode="group", yaxis_title="ミリ秒", yaxis_type="log")
+        st.plotly_chart(figure)
+        st.dataframe(pd.DataFrame([
+            {"処理": name, "回数": timing["count"], "合計 (秒)": round(timing["total"], 3),
+             **{f"{quantile} (ミリ秒)": round((timing[quantile] or 0) * 1000, 2) for quantile in ("p50", "p90", "p99")}}
+            for name, timing in timings.items()
+        ]), hide_index=True)
+
+        # 直近の記録の推移
+        selected = st.selectbox("処理を選択してください", names, key="metrics_name")
+        points = metrics.samples(selected)
+        figure = go.Figure(go.Scatter(
+            x=[pd.Timestamp.fromtimestamp(at) for at, _ in points], y=[seconds * 1000 for _, seconds in points], mode="markers"
+        ))
+        figure.update_layout(yaxis_title="ミリ秒")
+        st.plotly_chart(figure)
+    else:
+        st.info("まだ記録がありません。")
+
+    counters = metrics.counters()
+    if counters:
+        st.subheader("回数")
+        st.dataframe(pd.DataFrame([{"項目": name, "回数": value} for name, value in counters.items()]), hide_index=True)
+    st.subheader("スナップショット")
+    st.json(snapshot_stats())
+    st.download_button("Prometheus 形式でダウンロード", metrics.prometheus_text(), file_name="metrics.txt")
+
 # メイン関数
 def main():
-    # タイトルの背景を設定
-    title_bg_style = '''
-    <style>
-    .title-container {
-        font-family: 'Arial', sans-serif; /* フォントを設定 */
-        background-color: #008080; /* 暗い背景色 */
-        padding: 10px; /* 内側の余白を設定 */
-        border-radius: 5px; /* 角を丸くする */
-        text-align: center; /* 中央揃え */
-        width: 100%; /* 横幅を100%に設定 */
-        margin-bottom: 30px; /* タイトル下に余白を追加 */
-    }
-    .spacer {
-        height: 20px; /* 空白の高さを設定 */
-    }
-    </style>
-    <div class="title-container">
-        <h1 style="color: #ffffff;">Rally</h1>
-        <p style="color: #ffffff;">ー サークル・学生団体と学生を繋ぐ ー</p>
-    </div>
-    <div class="spacer"></div> <!-- タイトルとタブの間に空白を挿入 -->
-    '''
-    st.markdown(title_bg_style, unsafe_allow_html=True)
+    # タイトル
+    st.markdown(TITLE_HTML, unsafe_allow_html=True)
 
     # セッションに現在のタブを保存
     if "current_tab" not in st.session_state:
         st.session_state["current_tab"] = "イベント一覧"  # 初期タブを設定
 
-    # タブの選択
-    tabs = ["イベント一覧", "ジャンルを選択する", "イベントマップ", "レビューを書く", "サークルを登録する", "サークル管理者画面"]
-    selected_tab = st.selectbox("タブを選択してください", tabs, index=tabs.index(st.session_state["current_tab"]))
+    # タブの選択 (選んだタブはキーで session_state に保存されるので再実行し直す必要はない)
+    tabs = ["イベント一覧", "ジャンルを選択する", "イベントマップ", "レビューを書く", "サークルを登録する", "サークル管理者画面", "パフォーマンス"]
+    selected_tab = st.selectbox("タブを選択してください", tabs, key="current_tab")
 
-    # タブが変更された場合にリロード
-    if selected_tab != st.session_state["current_tab"]:
-        st.session_state["current_tab"] = selected_tab
-        st.rerun()
+    metrics.start_exporters()  # 計測結果の書き出し (有効なときだけ。プロセスごとに1回)
+    storage.start_archiver()  # 終了したイベントの定期的な保管 (プロセスごとに1回)
+
+    # タブごとの処理 (描画にかかった時間をタブごとに記録する)
+    with metrics.timer(f"tab.{selected_tab}"):
+        show_tab(selected_tab)
 
-    # タブごとの処理
-    groups = load_data()
+# 選んだタブの描画 (スナップショットはデータが変わったときだけ読み直される)
+def show_tab(selected_tab):
+    snapshot = get_snapshot()
+    st.session_state["seen_version"] = snapshot.version
+    if LIVE_UPDATE_KINDS.get(selected_tab):
+        live_updates(LIVE_UPDATE_KINDS[selected_tab])
     if selected_tab == "イベント一覧":
-        display_event_list(groups)
+        display_event_list(snapshot)
     elif selected_tab == "ジャンルを選択する":
-        genre_selection_page()
+        genre_selection_page(snapshot)
     elif selected_tab == "イベントマップ":
-        display_map(groups)
+        display_map(snapshot)
     elif selected_tab == "レビューを書く":
-        review_page(groups)
+        review_page(snapshot)
     elif selected_tab == "サークルを登録する":
-        add_group_form(groups)
+        add_group_form(snapshot)
     elif selected_tab == "サークル管理者画面":
-        admin_panel(groups)
+        admin_panel(snapshot)
+    elif selected_tab == "パフォーマンス":
+        performance_page()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
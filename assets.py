@@ -0,0 +1,165 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+# 定数
+ICON_FOLDER = "data/icons"
+THUMB_FOLDER = "data/thumbnails"
+DEFAULT_ICON = "data/icons/default_icon.png"
+ICON_THUMB_SIZE = (80, 80)  # 40px 表示の2倍 (高解像度ディスプレイ向け)
+GENRE_THUMB_SIZE = (480, 320)
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+MAX_UPLOAD_PIXELS = 4096 * 4096
+ICON_MAX_SIZE = (512, 512)  # アップロードされたアイコンはこの大きさまで縮小して保存する
+CACHE_MAX_ENTRIES = 256
+THUMB_FORMATS = ("WEBP", "PNG")  # サムネイルの形式 (WebP が使えなければ PNG)
+# Pillow は読み込みに時間がかかるので、画像をデコード・エンコードするときに初めて読み込む
+# (ディスク上のサムネイルを返すだけなら読み込まない)
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+# アップロードされた画像を1回だけデコードして確認する
+def load_upload(uploaded_file, allowed_formats=("PNG",)):
+    from PIL import Image
+    data = uploaded_file.getvalue()
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise InvalidImage(f"画像ファイルが大きすぎます (上限 {MAX_UPLOAD_BYTES // (1024 * 1024)}MB)。")
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()  # 壊れたファイルを検出する (verify 後の画像は使えないので開き直す)
+        image = Image.open(io.BytesIO(data))
+        if image.format not in allowed_formats:
+            raise InvalidImage(f"{' / '.join(allowed_formats)} 形式の画像をアップロードしてください。")
+        if image.width * image.height > MAX_UPLOAD_PIXELS:
+            raise InvalidImage("画像の解像度が大きすぎます。")
+        image.load()
+    except InvalidImage:
+        raise
+    except Exception:
+        raise InvalidImage("画像ファイルを読み込めませんでした。")
+    return image
+
+
+# 新しく作るサムネイルの形式 (プロセスごとに1回だけ調べる)
+@lru_cache(maxsize=None)
+def thumb_format():
+    from PIL import features
+    return "WEBP" if features.check("webp") else "PNG"
+
+
+def _encode(image, size, fmt=None):
+    from PIL import Image, ImageOps
+    fmt = fmt or thumb_format()
+    thumb = ImageOps.exif_transpose(image)
+    thumb = thumb.convert("RGBA") if thumb.mode not in ("RGB", "RGBA") else thumb
+    thumb.thumbnail(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumb.save(buffer, format=fmt, **({"quality": 85} if fmt == "WEBP" else {"optimize": True}))
+    return buffer.getvalue()
+
+
+def _thumb_path(path, size, fmt=None):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(THUMB_FOLDER, f"{name}_{size[0]}x{size[1]}.{(fmt or thumb_format()).lower()}")
+
+
+def icon_path(group_name):
+    return os.path.join(ICON_FOLDER, f"{group_name}.png")
+
+
+# アイコンを保存し、サムネイルも同時に作る
+def save_icon(image, group_name):
+    from PIL import Image
+    os.makedirs(ICON_FOLDER, exist_ok=True)
+    path = icon_path(group_name)
+    icon = image.copy()
+    icon.thumbnail(ICON_MAX_SIZE, Image.LANCZOS)
+    icon.save(path, format="PNG", optimize=True)  # 再エンコードしてメタデータ等を取り除く
+    _write_thumbnail(path, icon, ICON_THUMB_SIZE)
+    invalidate(path)
+    return path
+
+
+def _write_thumbnail(path, image, size):
+    data = _encode(image, size)
+    os.makedirs(THUMB_FOLDER, exist_ok=True)
+    thumb_path = _thumb_path(path, size)
+    tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, thumb_path)
+    return data
+
+
+# サムネイルの読み込み (ディスク上のサムネイルが古いかなければ作り直す)
+def _load_thumbnail(path, size):
+    try:
+        source_mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    # 作成済みのサムネイルはどちらの形式でもそのまま返す (形式を調べるために Pillow を読み込まない)
+    for fmt in THUMB_FORMATS:
+        thumb_path = _thumb_path(path, size, fmt)
+        try:
+            if os.path.getmtime(thumb_path) >= source_mtime:
+                with open(thumb_path, "rb") as f:
+                    return f.read()
+        except OSError:
+            pass
+    from PIL import Image
+    with Image.open(path) as image:
+        return _write_thumbnail(path, image, size)
+
+
+# エンコード済みのサムネイルをメモリに保持する (LRU)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def thumbnail(path, size):
+    key = (path, size)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    data = _load_thumbnail(path, size)  # 見つからない場合 (None) も覚えておく
+    with _cache_lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return data
+
+
+def invalidate(path):
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == path]:
+            del _cache[key]
+
+
+# サークルアイコンのサムネイル (見つからなければデフォルトのアイコン)
+# 戻り値: (サムネイル, 見つかったか)
+def icon_thumbnail(path):
+    data = thumbnail(path, ICON_THUMB_SIZE) if path else None
+    if data is not None:
+        return data, True
+    return thumbnail(DEFAULT_ICON, ICON_THUMB_SIZE), not path
+
+
+# 既存の画像のサムネイルをまとめて作る
+def build_thumbnails(folders=(ICON_FOLDER, "data/images")):
+    count = 0
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        size = ICON_THUMB_SIZE if folder == ICON_FOLDER else GENRE_THUMB_SIZE
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith((".png", ".jpg", ".jpeg")):
+                if thumbnail(os.path.join(folder, name), size) is not None:
+                    count += 1
+    return count
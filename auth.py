@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import metrics
+import storage
+
+# 定数
+BCRYPT_ROUNDS = int(os.environ.get("RALLY_BCRYPT_ROUNDS", 12))  # ハッシュのコスト (2^rounds 回)
+POOL_WORKERS = int(os.environ.get("RALLY_BCRYPT_WORKERS", max(1, (os.cpu_count() or 2) // 2)))  # bcrypt に使うスレッド数の上限 (CPUの半分)
+MAX_PENDING = 16  # 待ち行列がこれを超えたら受け付けない
+HASH_TIMEOUT = 10  # 1回の照合を待つ上限 (秒)
+LOGIN_LIMIT = 5  # LOGIN_WINDOW 秒あたりのログイン試行回数の上限 (サークルごと・クライアントごと)
+LOGIN_WINDOW = 60
+TRUSTED_PROXIES = int(os.environ.get("RALLY_TRUSTED_PROXIES", 0))  # 前段のロードバランサー・プロキシの数 (X-Forwarded-For から接続元を取り出す。0 なら使わない)
+SESSION_TTL = 30 * 60  # ログイン状態の有効期限 (秒)
+DASHBOARD_PASSWORD = os.environ.get("RALLY_DASHBOARD_PASSWORD")  # パフォーマンスのタブのパスワード (未設定なら表示しない)
+
+
+class LoginRejected(Exception):
+    pass
+
+
+# 一定時間内の回数制限 (スライディングウィンドウ)
+class RateLimiter:
+    def __init__(self, limit=LOGIN_LIMIT, window=LOGIN_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._hits = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def allow(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                hits = self._hits[key]
+                while hits and now - hits[0] > self.window:
+                    hits.popleft()
+                if len(hits) >= self.limit:
+                    return False
+            for key in keys:
+                self._hits[key].append(now)
+            return True
+
+
+# bcrypt は GIL を解放するので、スレッドプールで上限を決めて実行すれば
+# ログインが集中しても他のセッションの描画は止まらない
+_pool = ThreadPoolExecutor(max_workers=POOL_WORKERS, thread_name_prefix="bcrypt")
+_pending = threading.BoundedSemaphore(MAX_PENDING)
+_limiter = RateLimiter()
+
+
+# 待ち行列の枠は計算が終わったとき (または取り消したとき) に返す
+# (待ちきれずに諦めた計算が残っている間は、その分だけ新しい計算を受け付けない)
+def _run(fn, *args):
+    if not _pending.acquire(blocking=False):
+        raise LoginRejected("現在ログインが混み合っています。しばらくしてから再度お試しください。")
+    try:
+        future = _pool.submit(fn, *args)
+    except BaseException:
+        _pending.release()
+        raise
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        with metrics.timer("auth.bcrypt"):  # 待ち行列で待った時間も含める
+            return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()  # まだ始まっていなければ取り消す (始まっていれば終わるまで枠を使う)
+        metrics.inc("auth.busy")
+        raise LoginRejected("現在ログインが混み合っています。しばらくしてから再度お試しください。")
+
+
+# パスワードハッシュ化関連
+# bcrypt はログイン・登録のときに初めて読み込む (起動を速くするため)
+def hash_password(password, rounds=None):
+    import bcrypt
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return _run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+
+def check_password(password, hashed):
+    import bcrypt
+    return _run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+# ログイン: 成功したらセッショントークンを返す (再実行のたびにハッシュを計算しなくて済む)
+def login(group_name, password, hashed, client_id):
+    if not _limiter.allow(("group", group_name), ("client", client_id)):
+        metrics.inc("auth.rate_limited")
+        raise LoginRejected("ログインの試行回数が多すぎます。しばらくしてから再度お試しください。")
+    if not hashed or not check_password(password, hashed):
+        metrics.inc("auth.login_failed")
+        return None
+    token = secrets.token_urlsafe(32)
+    storage.add_session(_token_hash(token), group_name, time.time() + SESSION_TTL)
+    return token
+
+
+# ログイン状態はデータベースに保存するので、どのプロセスに接続しても同じトークンが使える
+# (データベースにはトークンそのものではなくハッシュ値を保存する)
+def _token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+# トークンに対応するサークル名 (期限切れ・不明なら None)
+def session_group(token):
+    if not token:
+        return None
+    return storage.get_session(_token_hash(token))
+
+
+# パフォーマンスのタブのパスワードの確認 (サークルのログインと同じ回数制限をかける)
+def check_dashboard_password(password, client_id):
+    if not _limiter.allow(("dashboard", client_id)):
+        raise LoginRejected("ログインの試行回数が多すぎます。しばらくしてから再度お試しください。")
+    return bool(DASHBOARD_PASSWORD) and hmac.compare_digest(password.encode("utf-8"), DASHBOARD_PASSWORD.encode("utf-8"))
+
+
+def logout(token):
+    if token:
+        storage.delete_session(_token_hash(token))
@@ -0,0 +1,66 @@
+# イベント一覧の再実行時間と送信量の計測 (Streamlit AppTest でヘッドレス実行)
+# 全件表示とページング表示 (1ページ目) を比べる
+#
+#   python bench/event_list_render.py --events 1000 10000
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, record, run_isolated, timed, workdir
+
+sys.path.insert(0, ROOT)
+
+
+def walk(node):
+    yield node
+    for child in (getattr(node, "children", None) or {}).values():
+        yield from walk(child)
+
+
+def payload_size(at):
+    # ブラウザに送られる要素の protobuf のサイズ (概算)
+    return sum(len(node.proto.SerializeToString()) for node in walk(at._tree) if getattr(node, "proto", None) is not None)
+
+
+def count_elements(at):
+    return sum(1 for _ in walk(at._tree))
+
+
+def measure(events, limit):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=600)
+    at.run()  # 1回目はスナップショットの読み込みを含む (絞り込み条件もここで記録される)
+    at.session_state["event_list_limit"] = limit
+    at.run()
+    rerun = timed(at.run)[1]
+    return {"rerun_ms": round(rerun * 1000, 1), "payload_bytes": payload_size(at), "elements": count_elements(at)}
+
+
+def run(events, groups, queue):
+    import storage
+    from synthetic import populate
+    path = workdir()
+    storage.configure(os.path.join(path, "data", "groups.db"))
+    populate(groups, events // groups)
+    queue.put({
+        "events": events,
+        "all": measure(events, events),
+        "paged": measure(events, 10),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/event_list_render.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    # スナップショットのキャッシュが混ざらないよう件数ごとに別プロセスで計測する
+    results = [run_isolated(run, events, args.groups) for events in args.events]
+    record("event_list_render", {k: v for k, v in vars(args).items() if k != "out"}, results, args.out)
+
+
+if __name__ == "__main__":
+    main()
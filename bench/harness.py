@@ -0,0 +1,91 @@
+# ベンチマークの共通処理
+# 結果は bench/results/<名前>.jsonl に1回1行で追記する (コミット・日時・条件付き)
+# 同じ条件の行を比べれば、変更の前後で速くなったか・遅くなったかが分かる
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# 経過時間 (ミリ秒) の分布
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    def at(q):
+        return round(samples[min(int(len(samples) * q), len(samples) - 1)] * 1000, 2)
+    return {"count": len(samples), "p50_ms": at(0.5), "p90_ms": at(0.9), "p99_ms": at(0.99),
+            "max_ms": round(samples[-1] * 1000, 2)}
+
+
+# fn() を1回実行して (結果, 経過秒) を返す
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+# target(*args, result_queue) を別プロセスで実行して結果を受け取る
+# (キャッシュや読み込み済みのモジュールが計測の間で混ざらない。子プロセスが落ちたら終了する)
+def run_isolated(target, *args):
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=target, args=args + (results,))
+    proc.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not proc.is_alive():
+                raise SystemExit(f"計測用のプロセスが異常終了しました (終了コード {proc.exitcode})")
+    proc.join()
+    return result
+
+
+# アプリと同じ構成の作業ディレクトリ (data/icons・data/images はリポジトリのものを使う) に移動する
+def workdir():
+    path = tempfile.mkdtemp()
+    os.makedirs(os.path.join(path, "data"))
+    os.symlink(os.path.abspath(os.path.join(ROOT, "data", "icons")), os.path.join(path, "data", "icons"))
+    os.symlink(os.path.abspath(os.path.join(ROOT, "data", "images")), os.path.join(path, "data", "images"))
+    os.chdir(path)
+    return path
+
+
+def record(name, params, results, out=None):
+    entry = {
+        "bench": name,
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+    }
+    out = out or os.path.join(RESULTS_DIR, f"{name}.jsonl")
+    if out == "-":
+        print(json.dumps(entry, ensure_ascii=False))
+        return entry
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "a", encoding="utf-8") as file:
+        file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(json.dumps(entry, ensure_ascii=False, indent=2))
+    print(f"→ {out}", file=sys.stderr)
+    return entry
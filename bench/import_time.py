@@ -0,0 +1,122 @@
+# 起動時間 (import app にかかる時間) の予算の確認
+# python -X importtime で新しいプロセスから import app を何回か計測し、中央値を使う
+#   own:  アプリ自身の読み込み時間 (app の累計から streamlit の累計を引いたもの)
+#   heavy: import app の時点で読み込まれた重いモジュール (pandas・bcrypt・Pillow など。どれも読み込まれないのが正しい)
+#   tabs: 各タブを初めて表示したときに新しく読み込まれた重いモジュール (TAB_MODULES にないものは予算超過)
+# 予算を超えたら終了コード 1 で終了する (同じ確認は tests/test_import_time.py でテストとしても行う)
+#
+#   python bench/import_time.py --runs 5 --budget-ms 50
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, record, run_isolated, workdir
+
+sys.path.insert(0, ROOT)
+
+BUDGET_MS = 50  # アプリ自身の読み込み時間の上限 (ミリ秒)
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "bcrypt", "PIL", "jsonschema", "geopy", "plotly")
+# タブごとに読み込んでよい重いモジュール (表・地図・画像の表示では Streamlit 自身も pandas・numpy・Pillow を使う)
+TAB_MODULES = {
+    "イベント一覧": {"pandas", "numpy", "pyarrow", "PIL"},
+    "ジャンルを選択する": {"numpy", "PIL"},
+    "イベントマップ": {"pandas", "numpy", "pyarrow"},
+    "レビューを書く": set(),
+    "サークルを登録する": set(),
+    "サークル管理者画面": set(),
+    "パフォーマンス": set(),
+}
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+# -X importtime の出力から (アプリ全体の秒数, streamlit の秒数, アプリが読み込んだ重いモジュール)
+# 出力は読み込みが終わった順 (子が親より先) なので、streamlit の直前にある字下げの深い行が streamlit の読み込んだもの
+def parse(output):
+    entries = [(int(match[2]) / 1e6, len(match[3]), match[4]) for match in _LINE.finditer(output)]
+    total = streamlit = 0
+    by_streamlit = set()
+    for i, (cumulative, indent, name) in enumerate(entries):
+        if name == "app" and indent == 1:
+            total = cumulative
+        elif name == "streamlit":
+            streamlit = cumulative
+            j = i - 1
+            while j >= 0 and entries[j][1] > indent:
+                by_streamlit.add(j)
+                j -= 1
+    heavy = {name.split(".")[0] for i, (_, _, name) in enumerate(entries)
+             if i not in by_streamlit and name.split(".")[0] in HEAVY_MODULES}
+    return total, streamlit, heavy
+
+
+def measure_import():
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    return parse(proc.stderr)
+
+
+def measure_tab(tab, groups, events, queue):
+    import storage
+    from synthetic import populate
+    path = workdir()
+    storage.configure(os.path.join(path, "data", "groups.db"))
+    populate(groups, events, seed=0)
+    from streamlit.testing.v1 import AppTest
+    before = set(sys.modules)  # AppTest 自身が読み込むものは除く
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=600)
+    at.session_state["current_tab"] = tab
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{tab}: {at.exception[0].message}")
+    loaded = {name.split(".")[0] for name in set(sys.modules) - before}
+    queue.put(sorted(loaded & set(HEAVY_MODULES)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5, help="import app を計測する回数 (中央値を使う)")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="アプリ自身の読み込み時間の上限 (ミリ秒)")
+    parser.add_argument("--no-tabs", action="store_true", help="タブごとの確認を省く")
+    parser.add_argument("--groups", type=int, default=5, help="タブの表示に使う合成データのサークル数")
+    parser.add_argument("--events", type=int, default=5, help="合成データの1サークルあたりのイベント数")
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/import_time.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    runs = [measure_import() for _ in range(args.runs)]
+    total = statistics.median(run[0] for run in runs)
+    streamlit = statistics.median(run[1] for run in runs)
+    own = statistics.median(run[0] - run[1] for run in runs)
+    heavy = sorted(set().union(*(run[2] for run in runs)))
+    results = {
+        "total_ms": round(total * 1000, 1),
+        "streamlit_ms": round(streamlit * 1000, 1),
+        "own_ms": round(own * 1000, 1),
+        "heavy": heavy,
+    }
+    failures = []
+    if own * 1000 > args.budget_ms:
+        failures.append(f"import app: {results['own_ms']} ms (予算 {args.budget_ms} ms)")
+    if heavy:
+        failures.append(f"import app: 重いモジュールを読み込んでいます: {', '.join(heavy)}")
+    if not args.no_tabs:
+        results["tabs"] = {}
+        for tab, allowed in TAB_MODULES.items():
+            loaded = run_isolated(measure_tab, tab, args.groups, args.events)
+            results["tabs"][tab] = loaded
+            if set(loaded) - allowed:
+                failures.append(f"{tab}: 予定にないモジュールを読み込んでいます: {', '.join(sorted(set(loaded) - allowed))}")
+    results["ok"] = not failures
+
+    params = {k: v for k, v in vars(args).items() if k != "out"}
+    record("import_time", params, results, args.out)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(0 if results["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# 多数のセッションからの同時応募の負荷テスト (Streamlit AppTest でヘッドレス実行)
+# 複数プロセスがそれぞれ複数のセッションを開き、イベント一覧の応募フォームから同じイベントに応募する
+# 画面操作 (チェックボックス → 入力 → 送信) 1回あたりの時間の分布を計測し、
+# 応募者が1件も失われないこと・定員を超えて受け付けないことを確認する
+# 各プロセスは別々の Streamlit サーバー (ワーカー) に当たり、同じデータベースを共有する
+# プロセス数を複数指定すると、ワーカー数に対してスループットがどれだけ伸びるか (scaling) も計算する
+#
+#   python bench/load_sessions.py --processes 1 2 4 8 --sessions 5 --submissions 4
+import argparse
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, percentiles, record, timed, workdir
+
+sys.path.insert(0, ROOT)
+
+GROUP_NAME = "負荷テスト"
+
+
+def setup(args, capacity):
+    import storage
+    from synthetic import populate
+    path = workdir()
+    db_file = os.path.join(path, "data", "groups.db")
+    storage.configure(db_file)
+    group_id = storage.add_group(GROUP_NAME, "x")
+    event_id = storage.add_event(group_id, {"title": "同時応募", "date": "2099-04-01", "capacity": capacity})
+    if args.groups:
+        populate(args.groups, args.events, seed=args.seed)  # 一覧に表示される他のイベント
+    return path, event_id
+
+
+def open_session(event_id):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=600)
+    at.session_state["group_filter"] = [GROUP_NAME]  # 応募するイベントを1ページ目に表示する
+    at.run()
+    at.checkbox(key=f"apply_open_{event_id}").check().run()
+    return at
+
+
+def apply(at, event_id, name, email):
+    at.text_input(key=f"name_{event_id}").input(name)
+    at.text_input(key=f"email_{event_id}").input(email)
+    at.button(key=f"FormSubmitter:apply_form_{event_id}-送信").click().run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def worker(path, event_id, worker_id, args, start, latencies):
+    import storage
+    os.chdir(path)
+    storage.configure(os.path.join(path, "data", "groups.db"))
+    sessions = [open_session(event_id) for _ in range(args.sessions)]
+    start.wait()
+    local = []
+    for i in range(args.submissions):
+        for s, at in enumerate(sessions):
+            user = f"{worker_id}-{s}-{i}"
+            local.append(timed(apply, at, event_id, f"負荷 {user}", f"load{user}@example.ac.jp")[1])
+    latencies.extend(local)
+
+
+def run(processes, args):
+    import storage
+    expected = processes * args.sessions * args.submissions
+    capacity = args.capacity if args.capacity is not None else expected // 2
+    path, event_id = setup(args, capacity)
+
+    with multiprocessing.Manager() as manager:
+        start = manager.Barrier(processes + 1)  # 全プロセスのセッションが開いてから一斉に応募する
+        latencies = manager.list()
+        procs = [multiprocessing.Process(target=worker, args=(path, event_id, n, args, start, latencies))
+                 for n in range(processes)]
+        for p in procs:
+            p.start()
+        start.wait()
+        elapsed = timed(lambda: [p.join() for p in procs])[1]
+        latencies = list(latencies)
+
+    applicants = len(storage.list_applicants(event_id))
+    waitlist = len(storage.list_waitlist(event_id))
+    event = storage.list_events_by_id([event_id])[0]
+    counters_match = (event.applicant_count, event.waitlist_count) == (applicants, waitlist)
+    return {
+        "processes": processes,
+        "expected": expected,
+        "capacity": capacity,
+        "applicants": applicants,
+        "waitlist": waitlist,
+        "lost": expected - applicants - waitlist,
+        "counters_match": counters_match,
+        "ok": (applicants + waitlist == expected and applicants == min(capacity, expected) and counters_match
+               and all(p.exitcode == 0 for p in procs)),
+        "elapsed_s": round(elapsed, 3),
+        "submissions_per_s": round(expected / elapsed, 1),
+        "submit": percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8], help="ワーカー (プロセス) の数")
+    parser.add_argument("--sessions", type=int, default=5, help="1プロセスあたりのセッション数")
+    parser.add_argument("--submissions", type=int, default=4, help="1セッションあたりの応募数")
+    parser.add_argument("--capacity", type=int, default=None, help="イベントの定員 (省略時は応募数の半分)")
+    parser.add_argument("--groups", type=int, default=10, help="一緒に表示する合成データのサークル数")
+    parser.add_argument("--events", type=int, default=20, help="合成データの1サークルあたりのイベント数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/load_sessions.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    results = [run(processes, args) for processes in args.processes]
+    # スループットが1プロセスのときの何倍になったか (ワーカー数と同じ倍率なら 1.0)
+    base = results[0]["submissions_per_s"] / results[0]["processes"]
+    for result in results:
+        result["scaling"] = round(result["submissions_per_s"] / (base * result["processes"]), 2)
+    params = dict({k: v for k, v in vars(args).items() if k != "out"}, cpu_count=os.cpu_count())
+    record("load_sessions", params, results, args.out)
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# ログイン集中時の他のユーザーへの影響の計測
+# 別スレッドでページ描画相当の処理 (絞り込み+検索) を繰り返し、その p99 レイテンシを
+#   - 平常時
+#   - 従来の方法 (スクリプトスレッドで直接 bcrypt) でログインが集中したとき
+#   - auth のスレッドプール経由でログインが集中したとき
+# で比べる
+#
+#   python bench/login_storm.py --logins 64
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, record
+
+sys.path.insert(0, ROOT)
+import bcrypt
+
+import auth
+from catalog import build_catalog, filter_events
+from models import Event
+from search import SearchIndex
+from synthetic import make_event, make_vocab
+
+
+def make_page(n_events):
+    rng = random.Random(0)
+    vocab = make_vocab(rng)
+    events = [Event(**make_event(rng, vocab, i), id=i, group_id=i % 100, group_name=f"サークル{i % 100}")
+              for i in range(n_events)]
+    df = build_catalog(events)
+    index = SearchIndex(events)
+
+    def page():
+        ids = index.search("勉強会")
+        filter_events(df, ids=ids, categories=["勉強会", "新歓"], sort="開催日が近い順")
+    return page
+
+
+def measure(page, storm, duration):
+    latencies = []
+    stop = threading.Event()
+
+    def render_loop():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            page()
+            latencies.append(time.perf_counter() - t0)
+            time.sleep(0.005)
+
+    renderer = threading.Thread(target=render_loop)
+    renderer.start()
+    workers = storm(stop) if storm else []
+    time.sleep(duration)
+    stop.set()
+    renderer.join()
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    return {
+        "samples": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def storm_with(check, hashed, logins):
+    def start(stop):
+        def hammer():
+            while not stop.is_set():
+                try:
+                    check("wrong-password", hashed)
+                except auth.LoginRejected:
+                    time.sleep(0.01)
+        workers = [threading.Thread(target=hammer) for _ in range(logins)]
+        for worker in workers:
+            worker.start()
+        return workers
+    return start
+
+
+def direct_check(password, hashed):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--logins", type=int, default=64, help="同時にログインを試みるセッション数")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/login_storm.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    page = make_page(args.events)
+    hashed = bcrypt.hashpw(b"secret", bcrypt.gensalt(auth.BCRYPT_ROUNDS)).decode("utf-8")
+    params = dict({k: v for k, v in vars(args).items() if k != "out"}, bcrypt_rounds=auth.BCRYPT_ROUNDS, pool_workers=auth.POOL_WORKERS,
+                  cpu_count=os.cpu_count())
+    record("login_storm", params, {
+        "idle": measure(page, None, args.duration),
+        "storm_direct": measure(page, storm_with(direct_check, hashed, args.logins), args.duration),
+        "storm_pool": measure(page, storm_with(auth.check_password, hashed, args.logins), args.duration),
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# 読み込み・保存と各タブの描画時間の計測 (Streamlit AppTest でヘッドレス実行)
+# 合成データ (N サークル × M イベント × K 応募者・レビュー) を groups.json として書き出し、
+#   load:     groups.json からデータベースへの取り込み
+#   snapshot: 読み込み用スナップショットの作成
+#   save:     応募・イベント追加1件ずつの書き込み
+#   pages:    各タブの初回表示 (cold) と再実行 (warm)
+# を計測して bench/results/pages.jsonl に追記する
+#
+#   python bench/pages.py --groups 10 100 --events 20 --applicants 30 --reviews 10
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, percentiles, record, run_isolated, timed, workdir
+
+sys.path.insert(0, ROOT)
+
+PASSWORD = "bench"
+TABS = ["イベント一覧", "ジャンルを選択する", "イベントマップ", "レビューを書く", "サークルを登録する", "サークル管理者画面"]
+
+
+def measure_tab(tab, reruns, token=None):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=600)
+    at.session_state["current_tab"] = tab
+    if token:
+        at.session_state["auth_token"] = token
+    _, cold = timed(at.run)
+    if at.exception:
+        raise RuntimeError(f"{tab}: {at.exception[0].message}")
+    warm = [timed(at.run)[1] for _ in range(reruns)]
+    return {"cold_ms": round(cold * 1000, 1), "warm": percentiles(warm)}
+
+
+def run(size, args, queue):
+    import auth
+    import storage
+    from snapshot import get_snapshot
+    from synthetic import make_document
+
+    groups, events, applicants, reviews = size
+    path = workdir()
+    hashed = auth.hash_password(PASSWORD, rounds=4)  # 取り込みの計測に bcrypt を含めない
+    document = make_document(groups, events, applicants, reviews, seed=args.seed, password=hashed)
+    with open(os.path.join(path, "data", "groups.json"), "w", encoding="utf-8") as file:
+        json.dump(document, file, ensure_ascii=False)
+
+    storage.configure(os.path.join(path, "data", "groups.db"), os.path.join(path, "data", "groups.json"))
+    _, load = timed(storage.data_version)  # 初回の接続でスキーマを作って取り込む
+    snapshot, cold_snapshot = timed(get_snapshot)
+
+    event_ids = list(snapshot.events_by_id)
+    group_id = snapshot.groups[0].id
+    apply = [timed(storage.add_applicant, event_ids[i % len(event_ids)], "計測 太郎", f"bench{i}@example.ac.jp")[1]
+             for i in range(args.writes)]
+    add_event = [timed(storage.add_event, group_id, {"title": f"計測イベント{i}", "capacity": 10})[1]
+                 for i in range(args.writes)]
+    _, delta_snapshot = timed(get_snapshot)  # 書き込み後は差分だけを読み込む
+
+    token = auth.login(snapshot.groups[0].name, PASSWORD, hashed, "bench")
+    pages = {tab: measure_tab(tab, args.reruns, token if tab == "サークル管理者画面" else None) for tab in TABS}
+    queue.put({
+        "groups": groups, "events": groups * events, "applicants": groups * events * applicants,
+        "reviews": groups * events * min(reviews, applicants),
+        "load_ms": round(load * 1000, 1),
+        "snapshot_cold_ms": round(cold_snapshot * 1000, 1),
+        "snapshot_delta_ms": round(delta_snapshot * 1000, 1),
+        "save": {"add_applicant": percentiles(apply), "add_event": percentiles(add_event)},
+        "pages": pages,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--events", type=int, default=20, help="1サークルあたりのイベント数")
+    parser.add_argument("--applicants", type=int, default=30, help="1イベントあたりの応募者数")
+    parser.add_argument("--reviews", type=int, default=10, help="1イベントあたりのレビュー数")
+    parser.add_argument("--writes", type=int, default=50, help="保存の計測回数")
+    parser.add_argument("--reruns", type=int, default=5, help="各タブの再実行の回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/pages.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    results = []
+    for groups in args.groups:
+        # キャッシュが混ざらないよう規模ごとに別プロセスで計測する
+        results.append(run_isolated(run, (groups, args.events, args.applicants, args.reviews), args))
+    record("pages", {k: v for k, v in vars(args).items() if k != "out"}, results, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# 全文検索インデックスと線形スキャンの比較
+#
+#   python bench/search_index.py --events 100000
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, record
+
+sys.path.insert(0, ROOT)
+from models import Event
+from search import SearchIndex
+from synthetic import make_event, make_vocab
+
+QUERIES = ["python", "勉強会", "渋谷", "初心者歓迎 合宿", "ハッカソン", "研究発表", "存在しない語句", "茶", "会"]  # 1文字の検索語も含める
+
+
+def make_events(n, seed=0):
+    rng = random.Random(seed)
+    vocab = make_vocab(rng)
+    return [Event(**make_event(rng, vocab, i), id=i, group_name=f"サークル{i % 500}") for i in range(n)]
+
+
+def linear_scan(events, query):
+    return [event for event in events if query.lower() in event.title.lower()]
+
+
+def timeit(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/search_index.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    t0 = time.perf_counter()
+    index = SearchIndex(events)
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for event in events[:1000]:
+        index.update(event.replace(title=event.title + " 更新"))
+    update = (time.perf_counter() - t0) / 1000
+
+    results = {"build_s": round(build, 2), "update_ms": round(update * 1000, 4), "queries": {}}
+    for query in QUERIES:
+        results["queries"][query] = {
+            "hits": len(index.search(query)),
+            "index_ms": round(timeit(lambda: index.search(query, limit=20), args.repeat), 3),
+            "linear_scan_ms": round(timeit(lambda: linear_scan(events, query), args.repeat), 3),
+        }
+    record("search_index", {k: v for k, v in vars(args).items() if k != "out"}, results, args.out)
+
+
+if __name__ == "__main__":
+    main()
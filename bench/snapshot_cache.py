@@ -0,0 +1,53 @@
+# スナップショットキャッシュの計測
+# 定常状態 (データ変更なし) の get_snapshot() と、書き込み直後の再読み込みの時間を比べる
+#
+#   python bench/snapshot_cache.py --events 5000
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, record
+
+sys.path.insert(0, ROOT)
+import snapshot
+import storage
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--reruns", type=int, default=1000)
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/snapshot_cache.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    storage.configure(os.path.join(tempfile.mkdtemp(), "snapshot.db"))
+    group_id = storage.add_group("計測用サークル", "x")
+    with storage.transaction():
+        for i in range(args.events):
+            storage.add_event(group_id, {"title": f"イベント{i}", "date": "2025-04-01", "category": "勉強会"})
+
+    snapshot.get_snapshot()
+    t0 = time.perf_counter()
+    for _ in range(args.reruns):
+        snapshot.get_snapshot()
+    steady = (time.perf_counter() - t0) / args.reruns
+
+    storage.add_applicant(1, "計測", "bench@example.com")  # バージョンを進める
+    t0 = time.perf_counter()
+    snapshot.get_snapshot()
+    reload = time.perf_counter() - t0
+
+    stats = snapshot.stats()
+    record("snapshot_cache", {k: v for k, v in vars(args).items() if k != "out"}, {
+        "steady_state_ms": round(steady * 1000, 4),
+        "reload_ms": round(reload * 1000, 2),
+        "hit_rate": round(stats["hit_rate"], 4),
+        "misses": stats["misses"],
+    }, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# 応募の同時書き込みストレステスト
+# 複数プロセスから同時に storage.add_applicant() を呼び、応募者が1件も失われないこと、
+# 定員を超えて受け付けないこと (超えた分はすべてキャンセル待ちになること) を確認する
+#
+#   python bench/stress_apply.py --processes 16 --submissions 50 --capacity 300
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from harness import ROOT, record
+
+sys.path.insert(0, ROOT)
+import storage
+
+
+def setup(db_file, capacity):
+    storage.configure(db_file)  # 初期データは取り込まない
+    group_id = storage.add_group("ストレステスト", "x")
+    return storage.add_event(group_id, {"title": "同時応募", "capacity": capacity})
+
+
+def worker(db_file, event_id, worker_id, submissions, start, latencies):
+    storage.configure(db_file)
+    start.wait()
+    local = []
+    for i in range(submissions):
+        t0 = time.perf_counter()
+        storage.add_applicant(event_id, f"user{worker_id}-{i}", f"user{worker_id}-{i}@example.com")
+        local.append(time.perf_counter() - t0)
+    latencies.extend(local)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=16)
+    parser.add_argument("--submissions", type=int, default=50, help="1プロセスあたりの応募数")
+    parser.add_argument("--capacity", type=int, default=None, help="イベントの定員 (省略時は応募数の半分)")
+    parser.add_argument("--out", default=None, help='結果の追記先 (省略時は bench/results/stress_apply.jsonl、"-" で標準出力)')
+    args = parser.parse_args()
+
+    expected = args.processes * args.submissions
+    capacity = args.capacity if args.capacity is not None else expected // 2
+    db_file = os.path.join(tempfile.mkdtemp(), "stress.db")
+    event_id = setup(db_file, capacity)
+
+    with multiprocessing.Manager() as manager:
+        start = manager.Event()
+        latencies = manager.list()
+        procs = [
+            multiprocessing.Process(target=worker, args=(db_file, event_id, n, args.submissions, start, latencies))
+            for n in range(args.processes)
+        ]
+        for p in procs:
+            p.start()
+        t0 = time.perf_counter()
+        start.set()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+        latencies = sorted(latencies)
+
+    applicants = len(storage.list_applicants(event_id))
+    waitlist = len(storage.list_waitlist(event_id))
+    event = storage.list_events_by_id([event_id])[0]
+    stored = applicants + waitlist
+    ok = (stored == expected and applicants == min(capacity, expected)
+          and (event.applicant_count, event.waitlist_count) == (applicants, waitlist))
+    result = {
+        "processes": args.processes,
+        "expected": expected,
+        "capacity": capacity,
+        "applicants": applicants,
+        "waitlist": waitlist,
+        "lost": expected - stored,
+        "counters_match": (event.applicant_count, event.waitlist_count) == (applicants, waitlist),
+        "elapsed_s": round(elapsed, 3),
+        "writes_per_s": round(expected / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+    result["ok"] = ok and all(p.exitcode == 0 for p in procs)
+    record("stress_apply", {k: v for k, v in vars(args).items() if k != "out"}, result, args.out)
+    sys.exit(0 if result["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
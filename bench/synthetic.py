@@ -0,0 +1,126 @@
+# ベンチマーク用の合成データ
+# N サークル × M イベント × K 応募者・レビューのデータを、日本語のテキストと都内の座標付きで作る
+#
+#   python bench/synthetic.py --groups 100 --events 20 --applicants 30 --reviews 10 --out groups.json
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import storage
+from models import DATA_VERSION
+
+WORDS = ["Python", "勉強会", "新歓", "フットサル", "ボランティア", "プログラミング", "合宿", "旅行", "交流会",
+         "インターン", "説明会", "初心者歓迎", "ハッカソン", "読書会", "写真", "料理", "英語", "キャンプ", "ダンス", "音楽"]
+KANJI = "学生会議研究発表講座演習体験企画運営交流春夏秋冬合宿大会練習試合映画写真音楽美術文化国際地域環境料理茶道書道将棋囲碁"
+CATEGORIES = ["新歓", "勉強会", "交流会", "スポーツ", "ボランティア", "ものづくり系", "旅行", "インターン", "追いコン"]
+PLACES = {
+    "東京駅": (35.6812, 139.7671),
+    "渋谷": (35.6580, 139.7016),
+    "新宿": (35.6896, 139.7006),
+    "池袋": (35.7295, 139.7109),
+    "早稲田大学": (35.7091, 139.7197),
+    "上野公園": (35.7156, 139.7745),
+    "横浜": (35.4658, 139.6223),
+    "品川": (35.6285, 139.7388),
+    "秋葉原": (35.6984, 139.7731),
+    "吉祥寺": (35.7030, 139.5795),
+}
+NAMES = ["佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+GIVEN_NAMES = ["太郎", "花子", "翔太", "美咲", "大輝", "葵", "蓮", "陽菜", "悠真", "結衣", "湊", "凛", "颯太", "さくら"]
+UNIVERSITIES = ["東京", "早稲田", "慶應", "明治", "立教", "法政", "中央", "上智", "青山", "日本"]
+TOPICS = ["プログラミング", "フットサル", "テニス", "写真", "軽音楽", "茶道", "英語", "ボランティア", "映画", "料理", "登山", "将棋"]
+SUFFIXES = ["サークル", "部", "研究会", "同好会"]
+FEEDBACK = ["とても楽しかったです！", "初心者でも参加しやすかった。", "もう少し時間が欲しかった。", "普通", "また参加したいです。",
+            "説明が分かりやすかった。", "会場が少し狭かった。", "友達が増えました！"]
+
+
+def make_vocab(rng, n=3000):
+    # 既存の単語に加えて、漢字2〜4文字の合成語を語彙として作る
+    return WORDS + ["".join(rng.choice(KANJI) for _ in range(rng.randint(2, 4))) for _ in range(n)]
+
+
+def make_event(rng, vocab, number):
+    location = rng.choice(list(PLACES))
+    lat, lon = PLACES[location]
+    return {
+        "title": "".join(rng.sample(vocab, 2)) + f" #{number}",
+        "description": "、".join(rng.sample(vocab, 6)) + "。ぜひご参加ください！",
+        "date": (date.today() + timedelta(days=rng.randint(-90, 270))).isoformat(),  # 1/4 は終了したイベント
+        "location": location,
+        "latitude": lat + rng.uniform(-0.01, 0.01),
+        "longitude": lon + rng.uniform(-0.01, 0.01),
+        "capacity": rng.choice([10, 20, 30, 50, 100]),
+        "category": rng.choice(CATEGORIES),
+    }
+
+
+def make_group_name(rng, number):
+    return f"{rng.choice(UNIVERSITIES)}大学{rng.choice(TOPICS)}{rng.choice(SUFFIXES)}{number}"
+
+
+# 応募者 (number 番目の人。同じイベントでメールアドレスが重ならない)
+def make_person(rng, number):
+    return {"name": f"{rng.choice(NAMES)} {rng.choice(GIVEN_NAMES)}", "email": f"user{number}@example.ac.jp"}
+
+
+def make_review(rng, person):
+    return dict(person, satisfaction=rng.choices(range(1, 6), weights=[1, 2, 4, 6, 5])[0], feedback=rng.choice(FEEDBACK))
+
+
+# groups.json (最新の形式) と同じ構造のデータ
+def make_document(groups, events_per_group, applicants_per_event=0, reviews_per_event=0, seed=0, password="x"):
+    rng = random.Random(seed)
+    vocab = make_vocab(rng)
+    document = {"version": DATA_VERSION, "groups": []}
+    number = 0
+    for g in range(groups):
+        events = []
+        for _ in range(events_per_group):
+            event = make_event(rng, vocab, number)
+            number += 1
+            people = [make_person(rng, a) for a in range(applicants_per_event)]
+            event["applicants"] = people
+            event["reviews"] = [make_review(rng, person) for person in people[:reviews_per_event]]
+            events.append(event)
+        document["groups"].append({"name": make_group_name(rng, g), "password": password, "icon": None, "events": events})
+    return document
+
+
+# 現在の storage.DB_FILE に groups × events_per_group 件のイベントを書き込む
+def populate(groups, events_per_group, applicants_per_event=0, reviews_per_event=0, seed=0, password="x"):
+    document = make_document(groups, events_per_group, applicants_per_event, reviews_per_event, seed, password)
+    with storage.transaction():
+        for group in document["groups"]:
+            group_id = storage.add_group(group["name"], group["password"], group["icon"])
+            for event in group["events"]:
+                event_id = storage.add_event(group_id, event)
+                for person in event["applicants"]:
+                    storage.add_applicant(event_id, person["name"], person["email"])  # 定員を超えた分はキャンセル待ち
+                for review in event["reviews"]:
+                    storage.add_review(event_id, review["name"], review["email"], review["satisfaction"], review["feedback"])
+    return groups * events_per_group
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--events", type=int, default=20, help="1サークルあたりのイベント数")
+    parser.add_argument("--applicants", type=int, default=30, help="1イベントあたりの応募者数")
+    parser.add_argument("--reviews", type=int, default=10, help="1イベントあたりのレビュー数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="-", help='出力ファイル ("-" で標準出力)')
+    args = parser.parse_args()
+    document = make_document(args.groups, args.events, args.applicants, args.reviews, args.seed)
+    if args.out == "-":
+        json.dump(document, sys.stdout, ensure_ascii=False)
+    else:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(document, file, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
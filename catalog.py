@@ -0,0 +1,75 @@
+import pandas as pd
+
+# イベントの列指向テーブル (データバージョンごとに1回だけ作る)
+# 絞り込みと並べ替えは pandas のベクトル演算で行う
+COLUMNS = ["id", "group_id", "group_name", "group_icon", "title", "description", "date",
+           "location", "latitude", "longitude", "capacity", "category", "review_count", "review_total"]
+
+# 並べ替えの種類: 表示名 → (列, 昇順か)
+SORT_OPTIONS = {
+    "開催日が近い順": ("date", True),
+    "開催日が遠い順": ("date", False),
+    "募集人数が多い順": ("capacity", False),
+    "新着順": ("id", False),
+    "評価が高い順": ("rating", False),
+}
+
+
+def build_catalog(events):
+    df = pd.DataFrame.from_records([[getattr(event, column) for column in COLUMNS] for event in events], columns=COLUMNS)
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    df["capacity"] = pd.to_numeric(df["capacity"], errors="coerce")
+    df["category"] = df["category"].astype("category")
+    df["group_name"] = df["group_name"].astype("category")
+    df["rating"] = df["review_total"] / df["review_count"].where(df["review_count"] > 0)  # レビューがなければ NaN (末尾に並ぶ)
+    return df.set_index("id", drop=False).rename_axis(None)
+
+
+# 変更のあったイベントだけを差し替える (並び順は list_events と同じ団体ID・イベントID順)
+def update_catalog(df, events, removed_ids=()):
+    if not events:
+        # 削除・保管だけなら行を消すだけ (空の表と結合すると数値の列が object 型になり、以降の絞り込みが遅くなる)
+        return df.drop(index=list(removed_ids), errors="ignore")
+    dtypes = df.dtypes
+    changed = build_catalog(events)
+    df = pd.concat([df.drop(index=list(removed_ids) + list(changed.index), errors="ignore"), changed])
+    # 結合で object 型になった列を元の型に戻す (int と float の結合で float になるのはそのままにする)
+    restore = {column: dtype for column, dtype in dtypes.items()
+               if df[column].dtype == object and dtype != object and column not in ("category", "group_name")}
+    if restore:
+        df = df.astype(restore)
+    for column in ("category", "group_name"):  # 結合するとカテゴリー型が外れることがある
+        df[column] = df[column].astype("category")
+    return df.sort_values(["group_id", "id"], kind="stable")
+
+
+# 条件に合うイベントの行を返す (指定しなかった条件は無視する)
+def filter_events(df, ids=None, categories=None, groups=None, date_from=None, date_to=None,
+                  min_capacity=None, sort=None):
+    mask = pd.Series(True, index=df.index)
+    if ids is not None:
+        mask &= df.index.isin(ids)
+    if categories:
+        mask &= df["category"].isin(categories)
+    if groups:
+        mask &= df["group_name"].isin(groups)
+    if date_from is not None:
+        mask &= df["date"] >= pd.Timestamp(date_from)
+    if date_to is not None:
+        mask &= df["date"] <= pd.Timestamp(date_to)
+    if min_capacity:
+        mask &= df["capacity"] >= min_capacity
+    result = df[mask.to_numpy()]
+    if sort in SORT_OPTIONS:
+        column, ascending = SORT_OPTIONS[sort]
+        result = result.sort_values([column, "id"], ascending=[ascending, True], na_position="last", kind="stable")
+    elif ids is not None:
+        # 並べ替えの指定がなければ ids の順番 (検索の関連度順) を保つ
+        result = result.reindex([event_id for event_id in ids if event_id in result.index])
+    return result
+
+
+# 団体ごとにまとめる (最初に出てきた順に団体を並べ、団体内の順番は保つ)
+def group_together(df):
+    rank = df.groupby("group_id", sort=False, observed=True).ngroup()
+    return df.iloc[rank.to_numpy().argsort(kind="stable")]
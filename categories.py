@@ -0,0 +1,54 @@
+import threading
+
+from dates import DateIndex
+
+
+# カテゴリー (ジャンル) ごとのイベントの索引
+# カテゴリーごとに開催日の索引を持つので、件数も開催予定のイベントも
+# 二分探索で今日以降の部分を切り出すだけで分かる (全件を調べない)
+class CategoryIndex:
+    def __init__(self, events=()):
+        self._by_category = {}  # カテゴリー → DateIndex
+        self._categories = {}  # イベントID → カテゴリー
+        self._lock = threading.Lock()
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._categories)
+
+    # 追加 (既に登録済みなら置き換える。カテゴリーのないイベントは登録しない)
+    def add(self, event):
+        with self._lock:
+            self._remove(event.id)
+            if not event.category:
+                return
+            self._categories[event.id] = event.category
+            self._by_category.setdefault(event.category, DateIndex()).add(event)
+
+    update = add
+
+    def remove(self, event_id):
+        with self._lock:
+            self._remove(event_id)
+
+    def _remove(self, event_id):
+        category = self._categories.pop(event_id, None)
+        if category is None:
+            return
+        index = self._by_category[category]
+        index.remove(event_id)
+        if not len(index):
+            del self._by_category[category]
+
+    # カテゴリーのイベントID (開催日の順。since を指定するとその日以降だけ)
+    def events(self, category, since=None):
+        with self._lock:
+            index = self._by_category.get(category)
+        return index.between(since) if index else []
+
+    # カテゴリーごとの件数 (since を指定するとその日以降の件数)
+    def counts(self, since=None):
+        with self._lock:
+            indexes = list(self._by_category.items())
+        return {category: index.count(since) for category, index in indexes}
@@ -0,0 +1,59 @@
+import threading
+from collections import deque
+
+from models import Record
+
+# 変更の通知 (プロセス内の変更フィード)
+# storage の書き込みトランザクションが確定するたびに、データバージョンと
+# その中で行われた変更の一覧を publish する。読み込む側 (スナップショットや各セッション) は
+# 最後に見たバージョンより後の変更だけを受け取り、差分だけを反映する
+# 他のプロセスでの書き込みはこのフィードには流れないので、storage.changes_since() が
+# データベースの change_log から補う
+
+# 変更の種類
+GROUP_ADDED = "group_added"
+EVENT_ADDED = "event_added"
+EVENT_UPDATED = "event_updated"
+EVENT_DELETED = "event_deleted"
+APPLICANT_ADDED = "applicant_added"
+APPLICANT_REMOVED = "applicant_removed"
+WAITLIST_ADDED = "waitlist_added"
+REVIEW_ADDED = "review_added"
+
+MAX_VERSIONS = 1000  # 覚えておくバージョンの数 (これより古い差分は全体を読み直す。change_log も同じ)
+
+
+class Change(Record):
+    __slots__ = ("kind", "group_id", "event_id")
+
+
+class ChangeFeed:
+    def __init__(self, max_versions=MAX_VERSIONS):
+        self._log = deque(maxlen=max_versions)  # (バージョン, 変更のタプル)
+        self._lock = threading.Lock()
+
+    def publish(self, version, changes):
+        with self._lock:
+            self._log.append((version, tuple(changes)))
+
+    # version より後、until まで (省略時は最新まで) の変更の一覧
+    # 途中に分からないバージョンがあれば None を返す
+    # (他のプロセスでの書き込み・変更の種類を記録しない一括書き込み・古すぎる差分)
+    def since(self, version, until=None):
+        with self._lock:
+            entries = [entry for entry in self._log if entry[0] > version]
+        result = []
+        expected = version + 1
+        for entry_version, changes in entries:
+            if until is not None and entry_version > until:
+                break
+            if entry_version != expected or not changes:
+                return None
+            result.extend(changes)
+            expected += 1
+        if until is not None and expected != until + 1:
+            return None
+        return result
+
+
+FEED = ChangeFeed()
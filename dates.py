@@ -0,0 +1,70 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+
+UNDATED = "9999-12-31"  # 日付のないイベントは開催予定として最後に並べる
+
+
+def today():
+    return date.today().isoformat()
+
+
+# 今日から今週の日曜日まで: (開始日, 終了日)
+def this_week(day=None):
+    day = date.fromisoformat(day) if day else date.today()
+    return day.isoformat(), (day + timedelta(days=6 - day.weekday())).isoformat()
+
+
+# 開催日の索引
+# (開催日, イベントID) を日付順に並べて持ち、期間の問い合わせは二分探索で範囲を切り出すだけで答える
+# 開催日は "YYYY-MM-DD" の文字列なので、文字列の順番がそのまま日付の順番になる
+class DateIndex:
+    def __init__(self, events=()):
+        self._entries = []  # [(開催日, イベントID)] (日付順)
+        self._dates = {}  # イベントID → 開催日
+        self._lock = threading.Lock()
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._dates)
+
+    # 追加 (既に登録済みなら置き換える)
+    def add(self, event):
+        with self._lock:
+            self._remove(event.id)
+            day = event.date or UNDATED
+            self._dates[event.id] = day
+            insort(self._entries, (day, event.id))
+
+    update = add
+
+    def remove(self, event_id):
+        with self._lock:
+            self._remove(event_id)
+
+    def _remove(self, event_id):
+        day = self._dates.pop(event_id, None)
+        if day is not None:
+            del self._entries[bisect_left(self._entries, (day, event_id))]
+
+    def _range(self, start, end):
+        lo = bisect_left(self._entries, (start,)) if start else 0
+        hi = bisect_right(self._entries, (end, float("inf"))) if end else len(self._entries)
+        return lo, hi
+
+    # start 〜 end (両端を含む。省略すると制限なし) のイベントID (開催日の順)
+    # end を指定すると日付のないイベントは含まない
+    def between(self, start=None, end=None):
+        with self._lock:
+            lo, hi = self._range(start, end)
+            return [event_id for _, event_id in self._entries[lo:hi]]
+
+    def count(self, start=None, end=None):
+        with self._lock:
+            lo, hi = self._range(start, end)
+            return max(hi - lo, 0)
+
+    # 今日以降 (日付のないイベントを含む)
+    def upcoming(self, day=None):
+        return self.between(day or today())
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# 定数
+CACHE_FILE = "data/geocode_cache.db"
+CACHE_TTL = 30 * 24 * 60 * 60  # キャッシュの有効期限 (秒)
+NEGATIVE_CACHE_TTL = 24 * 60 * 60  # 見つからなかった地名の有効期限 (秒。地名辞典の更新や入力の揺れを考えて短くする)
+CACHE_MAX_ENTRIES = 10000  # これを超えたら最後に使われた時刻が古いものから削除
+USER_AGENT = "student-groups-app"
+
+
+# 地名の正規化 (全角/半角・大文字/小文字・空白の揺れを吸収)
+def normalize(place):
+    return " ".join(unicodedata.normalize("NFKC", place).lower().split())
+
+
+# ジオコーディングのプロバイダ
+# geocode(place) は (緯度, 経度) か、見つからなければ None を返す
+# 問い合わせに失敗した場合 (ネットワークの障害など) は例外を送出する (「見つからない」とは区別する)
+class NominatimProvider:
+    def __init__(self, user_agent=USER_AGENT, min_delay_seconds=1.0):
+        from geopy.extra.rate_limiter import RateLimiter
+        from geopy.geocoders import Nominatim
+        # Nominatim の利用規約 (1秒1リクエスト) を守る
+        # RateLimiter は既定では例外を握りつぶして None を返すので、失敗が「見つからない」としてキャッシュされないようにする
+        # (障害時に画面を長く待たせないよう、再試行は1回だけ)
+        self._geocode = RateLimiter(Nominatim(user_agent=user_agent).geocode, min_delay_seconds=min_delay_seconds,
+                                    max_retries=1, error_wait_seconds=1.0, swallow_exceptions=False)
+
+    def geocode(self, place):
+        location = self._geocode(place)
+        return (location.latitude, location.longitude) if location else None
+
+
+# 地名→座標の辞書を引くだけのプロバイダ (テストやオフライン用の地名辞典)
+class StaticProvider:
+    def __init__(self, places):
+        self.places = {normalize(name): tuple(coords) for name, coords in places.items()}
+
+    def geocode(self, place):
+        return self.places.get(normalize(place))
+
+
+# 永続キャッシュ (SQLite)
+class GeocodeCache:
+    def __init__(self, path=CACHE_FILE, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, negative_ttl=NEGATIVE_CACHE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode_cache ("
+            "key TEXT PRIMARY KEY, latitude REAL, longitude REAL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geocode_used ON geocode_cache(used_at)")
+
+    # 戻り値: (ヒットしたか, 座標 or None)
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT latitude, longitude, created_at FROM geocode_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None
+            if now - row[2] > (self.ttl if row[0] is not None else self.negative_ttl):
+                self._conn.execute("DELETE FROM geocode_cache WHERE key = ?", (key,))
+                return False, None
+            self._conn.execute("UPDATE geocode_cache SET used_at = ? WHERE key = ?", (now, key))
+        return True, ((row[0], row[1]) if row[0] is not None else None)
+
+    def put(self, key, coords):
+        now = time.time()
+        lat, lon = coords if coords else (None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache (key, latitude, longitude, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lon, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM geocode_cache WHERE key IN (SELECT key FROM geocode_cache ORDER BY used_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+
+class Geocoder:
+    def __init__(self, provider=None, cache=None):
+        self._provider = provider
+        self.cache = cache
+        self._provider_lock = threading.Lock()
+
+    @property
+    def provider(self):
+        # geopy は実際に問い合わせるときまで読み込まない
+        # (同時に初めて問い合わせても1つしか作らない。RateLimiter が複数あると1秒1回の制限を守れない)
+        if self._provider is None:
+            with self._provider_lock:
+                if self._provider is None:
+                    self._provider = NominatimProvider()
+        return self._provider
+
+    # 問い合わせに失敗したときは例外をそのまま送出し、キャッシュしない
+    def geocode(self, place):
+        key = normalize(place)
+        if self.cache is not None:
+            hit, coords = self.cache.get(key)
+            metrics.inc("geocoding.cache_hit" if hit else "geocoding.cache_miss")
+            if hit:
+                return coords
+        with metrics.timer("geocoding.lookup"):  # 外部サービスへの問い合わせ
+            try:
+                coords = self.provider.geocode(place)
+            except Exception:
+                metrics.inc("geocoding.error")
+                raise
+        if self.cache is not None:
+            self.cache.put(key, coords)
+        return coords
+
+    # 問い合わせに失敗した地名は None (キャッシュしないので次回また問い合わせる)
+    def _geocode_or_none(self, place):
+        try:
+            return self.geocode(place)
+        except Exception:
+            return None
+
+    # 複数の地名をまとめて変換 (重複は1回だけ問い合わせる)
+    # 戻り値: {地名: 座標 or None}
+    def geocode_many(self, places, max_workers=4):
+        unique = {}
+        for place in places:
+            unique.setdefault(normalize(place), place)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(unique, executor.map(self._geocode_or_none, unique.values())))
+        return {place: results[normalize(place)] for place in places}
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Geocoder(cache=GeocodeCache())
+        return _default
+
+
+def set_geocoder(geocoder):
+    global _default
+    with _default_lock:
+        _default = geocoder
+
+
+def geocode(place):
+    return get_geocoder().geocode(place)
+
+
+# 既存の座標を使い回す: 場所が変わっていなければ問い合わせない
+def geocode_if_changed(place, event):
+    if event and event.location == place and event.latitude is not None:
+        return event.latitude, event.longitude
+    return geocode(place)
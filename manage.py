@@ -0,0 +1,281 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import date
+from itertools import islice
+
+import jsonschema
+
+import assets
+import auth
+import geocoding
+import storage
+from models import APPLICANT_SCHEMA, EVENT_PROPERTIES, GROUP_SCHEMA
+
+# 一括インポート・エクスポート用のコマンドラインツール
+# 使い方:
+#   python manage.py import groups groups.csv
+#   python manage.py import events events.jsonl --batch-size 200
+#   python manage.py import applicants applicants.csv
+#   python manage.py export applicants applicants.csv
+#   python manage.py archive --before 2025-04-01
+#   python manage.py thumbnails
+# ファイルは CSV (.csv) か JSON Lines (.jsonl) で、"-" は標準入出力 (--format で形式を指定)
+# どちらも batch_size 行ずつ読み書きするので、ファイルが大きくても使うメモリは増えない
+
+# 定数
+BATCH_SIZE = 500  # 1回のトランザクションで書き込む行数
+GEOCODE_WORKERS = 4
+
+# 1行ずつのレコードのスキーマ (項目の定義は groups.json のスキーマと共通)
+SCHEMAS = {
+    "groups": {
+        "type": "object",
+        "properties": {
+            "name": GROUP_SCHEMA["properties"]["name"],
+            "password": GROUP_SCHEMA["properties"]["password"],  # 平文 (インポート時にハッシュ化する)
+            "password_hash": {"type": "string", "pattern": r"^\$2[aby]\$"},  # bcrypt のハッシュ
+            "icon": GROUP_SCHEMA["properties"]["icon"],
+        },
+        "required": ["name"],
+        "anyOf": [{"required": ["password"]}, {"required": ["password_hash"]}],
+    },
+    "events": {
+        "type": "object",
+        "properties": dict(EVENT_PROPERTIES, group_name={"type": "string", "minLength": 1}),
+        "required": ["group_name", "title"],
+    },
+    "applicants": {
+        "type": "object",
+        "properties": dict(APPLICANT_SCHEMA["properties"], event_id={"type": "integer"}),
+        "required": ["event_id"] + APPLICANT_SCHEMA["required"],
+    },
+}
+EXPORT_KINDS = list(storage.EXPORT_QUERIES)
+
+
+def _format(path, fmt):
+    if fmt:
+        return fmt
+    if path != "-":
+        ext = os.path.splitext(path)[1].lower()
+        if ext in (".csv", ".jsonl"):
+            return ext[1:]
+    raise SystemExit(f"形式が分かりません: {path} (--format csv または --format jsonl を指定してください)")
+
+
+# CSV はすべて文字列なので、スキーマの型に合わせて変換する (空欄は項目なしとして扱う)
+def _coerce(record, schema):
+    result = {}
+    for key, value in record.items():
+        if key is None or value in ("", None):  # 列数の多すぎる行・空欄
+            continue
+        types = schema["properties"].get(key, {}).get("type", [])
+        types = [types] if isinstance(types, str) else types
+        if isinstance(value, str):
+            try:
+                if "integer" in types:
+                    value = int(value)
+                elif "number" in types:
+                    value = float(value)
+            except ValueError:
+                pass  # 変換できない値はそのまま検証させてエラーにする
+        result[key] = value
+    return result
+
+
+# 1行ずつ読み込む: (行番号, レコード)
+# JSON として読めない行は行番号付きで表示して飛ばす (それまでのバッチは登録済みなので途中で止めない)
+def read_records(path, fmt, schema, errors):
+    file = sys.stdin if path == "-" else open(path, "r", encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            for line_no, record in enumerate(csv.DictReader(file), start=2):
+                yield line_no, _coerce(record, schema)
+        else:
+            for line_no, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    errors.append(line_no)
+                    print(f"{line_no}行目: JSON として読み込めません: {e}", file=sys.stderr)
+                    continue
+                yield line_no, record
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# 検証: 正しいレコードだけを返し、エラーは行番号付きで表示する
+def _validate(batch, validator, errors):
+    valid = []
+    for line_no, record in batch:
+        problems = sorted(validator.iter_errors(record), key=lambda e: list(e.path))
+        if problems:
+            errors.append(line_no)
+            for problem in problems:
+                field = ".".join(str(p) for p in problem.path) or "(レコード)"
+                print(f"{line_no}行目: {field}: {problem.message}", file=sys.stderr)
+        else:
+            valid.append((line_no, record))
+    return valid
+
+
+def _prepare_groups(batch):
+    records = []
+    for _, record in batch:
+        password = record.get("password_hash") or auth.hash_password(record["password"])
+        records.append({"name": record["name"], "password": password, "icon": record.get("icon")})
+    return records
+
+
+# 座標のないイベントは場所からまとめて変換する (キャッシュ済みの地名は問い合わせない)
+def _prepare_events(batch, errors, geocoder):
+    ids = storage.group_ids(record["group_name"] for _, record in batch)
+    places = [record["location"] for _, record in batch
+              if record.get("location") and (record.get("latitude") is None or record.get("longitude") is None)]
+    coords = geocoder.geocode_many(places, max_workers=GEOCODE_WORKERS) if places else {}
+    records = []
+    for line_no, record in batch:
+        if record["group_name"] not in ids:
+            errors.append(line_no)
+            print(f"{line_no}行目: サークルが見つかりません: {record['group_name']}", file=sys.stderr)
+            continue
+        event = dict(record, group_id=ids[record["group_name"]])
+        if event.get("location") in coords:
+            event["latitude"], event["longitude"] = coords[event["location"]] or (None, None)
+        records.append(event)
+    return records
+
+
+def _prepare_applicants(batch, errors):
+    ids = storage.event_ids(record["event_id"] for _, record in batch)
+    records = []
+    for line_no, record in batch:
+        if record["event_id"] not in ids:
+            errors.append(line_no)
+            print(f"{line_no}行目: イベントが見つかりません: {record['event_id']}", file=sys.stderr)
+            continue
+        records.append((line_no, record))
+    return records
+
+
+# 応募は定員を確認して登録する (満員ならキャンセル待ち、応募済みのメールアドレスはエラー)
+def _import_applicants(batch, errors):
+    records = _prepare_applicants(batch, errors)
+    results = storage.add_applicants([record for _, record in records])
+    imported = 0
+    for (line_no, record), result in zip(records, results):
+        if result == storage.DUPLICATE:
+            errors.append(line_no)
+            print(f"{line_no}行目: 応募済みです: {record['email']}", file=sys.stderr)
+        elif result == storage.NOT_FOUND:
+            errors.append(line_no)
+            print(f"{line_no}行目: イベントが見つかりません: {record['event_id']}", file=sys.stderr)
+        else:
+            imported += 1
+            if result == storage.WAITLISTED:
+                print(f"{line_no}行目: 定員に達しているためキャンセル待ちに追加しました: {record['email']}", file=sys.stderr)
+    return imported
+
+
+def import_file(kind, path, fmt=None, batch_size=BATCH_SIZE, geocoder=None):
+    schema = SCHEMAS[kind]
+    validator = jsonschema.Draft7Validator(schema, format_checker=jsonschema.Draft7Validator.FORMAT_CHECKER)
+    geocoder = geocoder or geocoding.get_geocoder()
+    errors = []
+    imported = 0
+    for batch in _batches(read_records(path, _format(path, fmt), schema, errors), batch_size):
+        batch = _validate(batch, validator, errors)
+        if kind == "groups":
+            imported += storage.add_groups(_prepare_groups(batch))
+        elif kind == "events":
+            imported += storage.add_events(_prepare_events(batch, errors, geocoder))
+        else:
+            imported += _import_applicants(batch, errors)
+    return imported, errors
+
+
+def export_file(kind, path, fmt=None, batch_size=BATCH_SIZE):
+    fmt = _format(path, fmt)
+    rows = storage.iter_export(kind, chunk_size=batch_size)
+    file = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    count = 0
+    try:
+        if fmt == "csv":
+            writer = None
+            for row in rows:
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                count += 1
+    finally:
+        if file is not sys.stdout:
+            file.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="サークル・イベント・応募者の一括インポート/エクスポート")
+    parser.add_argument("--db", default=storage.DB_FILE, help="データベースファイル")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="CSV / JSON Lines から登録する")
+    import_parser.add_argument("kind", choices=list(SCHEMAS))
+    import_parser.add_argument("path", help='入力ファイル ("-" で標準入力)')
+    import_parser.add_argument("--format", choices=["csv", "jsonl"])
+    import_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    export_parser = subparsers.add_parser("export", help="CSV / JSON Lines に書き出す")
+    export_parser.add_argument("kind", choices=EXPORT_KINDS)
+    export_parser.add_argument("path", help='出力ファイル ("-" で標準出力)')
+    export_parser.add_argument("--format", choices=["csv", "jsonl"])
+    export_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    archive_parser = subparsers.add_parser("archive", help="終了したイベントを保管用のテーブルに移す")
+    archive_parser.add_argument("--before", type=date.fromisoformat,
+                                help=f"この日より前のイベントを移す (YYYY-MM-DD。省略時は {storage.ARCHIVE_AFTER_DAYS} 日前)")
+
+    subparsers.add_parser("thumbnails", help="アイコン・ジャンル画像のサムネイルを前もって作る (デプロイ時などに実行)")
+
+    args = parser.parse_args(argv)
+    storage.configure(args.db, storage.DATA_FILE)
+
+    if args.command == "import":
+        imported, errors = import_file(args.kind, args.path, args.format, args.batch_size)
+        print(f"{imported} 件を登録しました。", file=sys.stderr)
+        if errors:
+            print(f"{len(errors)} 行はエラーのため登録しませんでした。", file=sys.stderr)
+            return 1
+    elif args.command == "export":
+        count = export_file(args.kind, args.path, args.format, args.batch_size)
+        print(f"{count} 件を書き出しました。", file=sys.stderr)
+    elif args.command == "archive":
+        count = storage.archive_events(args.before.isoformat() if args.before else None)
+        print(f"{count} 件のイベントを保管しました。", file=sys.stderr)
+    else:
+        count = assets.build_thumbnails()
+        print(f"{count} 件の画像のサムネイルを用意しました。", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import nullcontext
+from functools import wraps
+
+# 処理時間と回数の計測
+# どこで時間がかかっているか (DB の読み書き・ジオコーディング・bcrypt・各タブの描画) を
+# 本番でも分かるように、処理ごとに直近 WINDOW 回の時間を覚えておき、分位点 (p50/p90/p99) を計算する
+# 無効のとき (既定) は timer() が何もしないコンテキストを返し、timed() は関数をそのまま返すので負担はほぼない
+#
+# 環境変数:
+#   RALLY_METRICS=1              計測を有効にする
+#   RALLY_METRICS_FILE=path      Prometheus のテキスト形式で定期的にファイルへ書き出す
+#   RALLY_METRICS_PORT=9100      Prometheus のテキスト形式を http://localhost:9100/metrics で公開する
+
+ENABLED = os.environ.get("RALLY_METRICS", "") not in ("", "0")
+EXPORT_FILE = os.environ.get("RALLY_METRICS_FILE")
+EXPORT_PORT = int(os.environ.get("RALLY_METRICS_PORT", 0))
+EXPORT_INTERVAL = 15  # ファイルへ書き出す間隔 (秒)
+WINDOW = 1024  # 分位点の計算に使う直近の回数
+QUANTILES = (0.5, 0.9, 0.99)
+PREFIX = "rally"
+
+_NOOP = nullcontext()
+
+
+class Timing:
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=WINDOW)  # (時刻, 秒)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.samples.append((time.time(), seconds))
+
+    def quantiles(self):
+        values = sorted(seconds for _, seconds in self.samples)
+        if not values:
+            return {q: None for q in QUANTILES}
+        return {q: values[min(int(len(values) * q), len(values) - 1)] for q in QUANTILES}
+
+
+_lock = threading.Lock()
+_timings = defaultdict(Timing)
+_counters = defaultdict(int)
+
+
+def observe(name, seconds):
+    with _lock:
+        _timings[name].add(seconds)
+
+
+def inc(name, amount=1):
+    if ENABLED:
+        with _lock:
+            _counters[name] += amount
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# with metrics.timer("storage.write"): ... の中の処理時間を記録する
+def timer(name):
+    return _Timer(name) if ENABLED else _NOOP
+
+
+# 関数の処理時間を記録するデコレータ (無効のときは関数をそのまま返す)
+def timed(name):
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 集計: {名前: {"count", "total", 分位点...}}
+def timings():
+    with _lock:
+        items = [(name, timing.count, timing.total, timing.quantiles()) for name, timing in _timings.items()]
+    return {name: dict({"count": count, "total": total}, **{f"p{round(q * 100)}": value for q, value in quantiles.items()})
+            for name, count, total, quantiles in sorted(items)}
+
+
+# 直近の記録: [(時刻, 秒)]
+def samples(name):
+    with _lock:
+        timing = _timings.get(name)
+        return list(timing.samples) if timing else []
+
+
+def counters():
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Prometheus のテキスト形式 (処理時間は summary、回数は counter)
+def prometheus_text():
+    lines = [f"# TYPE {PREFIX}_duration_seconds summary"]
+    for name, timing in timings().items():
+        label = f'name="{_label(name)}"'
+        for q in QUANTILES:
+            value = timing[f"p{round(q * 100)}"]
+            if value is not None:
+                lines.append(f'{PREFIX}_duration_seconds{{{label},quantile="{q}"}} {value:.6f}')
+        lines.append(f"{PREFIX}_duration_seconds_sum{{{label}}} {timing['total']:.6f}")
+        lines.append(f"{PREFIX}_duration_seconds_count{{{label}}} {timing['count']}")
+    lines.append(f"# TYPE {PREFIX}_events_total counter")
+    for name, value in counters().items():
+        lines.append(f'{PREFIX}_events_total{{name="{_label(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        file.write(prometheus_text())
+    os.replace(tmp, path)  # 読み込む側が書きかけのファイルを見ないように置き換える
+
+
+def _export_file_loop(path):
+    while True:
+        time.sleep(EXPORT_INTERVAL)
+        try:
+            write_file(path)
+        except OSError:
+            pass  # 書き出せなくてもアプリは止めない
+
+
+def _serve(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+_exporters_started = False
+
+
+# 書き出し用のスレッドを起動する (プロセスごとに1回だけ)
+def start_exporters():
+    global _exporters_started
+    if not ENABLED:
+        return
+    with _lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    if EXPORT_FILE:
+        threading.Thread(target=_export_file_loop, args=(EXPORT_FILE,), daemon=True).start()
+    if EXPORT_PORT:
+        threading.Thread(target=_serve, args=(EXPORT_PORT,), daemon=True).start()
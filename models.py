@@ -0,0 +1,203 @@
+import json
+
+import metrics
+
+# データモデル
+# サークル・イベント・応募者・レビューを __slots__ 付きのクラスで表す
+# (辞書より小さく、属性名の打ち間違いはすぐにエラーになる)
+# 作成後は変更できないので、スナップショットやインデックスでそのまま共有できる
+
+DATA_VERSION = 2  # groups.json の形式のバージョン
+RATINGS = range(1, 6)  # 満足度 (⭐1〜⭐5)
+
+
+class Record:
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} は変更できません")
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(**dict(row))
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    # 一部の値だけを変えたコピー
+    def replace(self, **changes):
+        return type(self)(**dict(self.as_dict(), **changes))
+
+
+# レビューの集計 (review_stats テーブルの列)
+class ReviewStats:
+    __slots__ = ()
+    STATS_FIELDS = ("review_count", "review_total") + tuple(f"rating_{rating}" for rating in RATINGS)
+
+    # 平均満足度 (レビューがなければ None)
+    @property
+    def rating(self):
+        return self.review_total / self.review_count if self.review_count else None
+
+    # 満足度ごとの件数 (⭐1〜⭐5 の順)
+    @property
+    def ratings(self):
+        return tuple(getattr(self, f"rating_{rating}") or 0 for rating in RATINGS)
+
+
+class Group(ReviewStats, Record):
+    __slots__ = ("id", "name", "icon", "password") + ReviewStats.STATS_FIELDS
+
+
+class Event(ReviewStats, Record):
+    FIELDS = ("title", "description", "date", "location", "latitude", "longitude", "capacity", "category")
+    __slots__ = ("id", "group_id", "group_name", "group_icon") + FIELDS + ReviewStats.STATS_FIELDS + (
+        "applicant_count", "waitlist_count")  # event_seats テーブルの人数
+
+    # 残りの席数 (定員が未設定なら None)
+    @property
+    def seats_left(self):
+        if self.capacity is None:
+            return None
+        return max(self.capacity - (self.applicant_count or 0), 0)
+
+
+class Applicant(Record):
+    __slots__ = ("event_id", "name", "email")
+
+
+class Review(Record):
+    __slots__ = ("event_id", "name", "email", "satisfaction", "feedback")
+
+
+# groups.json のスキーマ (インポート時に1回だけ検証する)
+_NULLABLE_STRING = {"type": ["string", "null"]}
+EMAIL = {"type": "string", "pattern": r"^[^@\s]+@[^@\s]+$"}
+EVENT_PROPERTIES = {
+    "title": {"type": "string", "minLength": 1},
+    "description": _NULLABLE_STRING,
+    "date": {"type": ["string", "null"], "pattern": r"^\d{4}-\d{2}-\d{2}$", "format": "date"},  # 存在しない日付 (2月30日など) も拒否する
+    "location": _NULLABLE_STRING,
+    "latitude": {"type": ["number", "null"], "minimum": -90, "maximum": 90},
+    "longitude": {"type": ["number", "null"], "minimum": -180, "maximum": 180},
+    "capacity": {"type": ["integer", "null"], "minimum": 0},
+    "category": _NULLABLE_STRING,
+}
+APPLICANT_SCHEMA = {
+    "type": "object",
+    "properties": {"name": {"type": "string", "minLength": 1}, "email": EMAIL},
+    "required": ["name", "email"],
+}
+REVIEW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "email": EMAIL,
+        "satisfaction": {"type": "integer", "minimum": RATINGS[0], "maximum": RATINGS[-1]},
+        "feedback": {"type": "string"},
+    },
+    "required": ["name", "email", "satisfaction", "feedback"],
+}
+EVENT_SCHEMA = {
+    "type": "object",
+    "properties": dict(
+        EVENT_PROPERTIES,
+        applicants={"type": "array", "items": APPLICANT_SCHEMA},
+        reviews={"type": "array", "items": REVIEW_SCHEMA},
+    ),
+    "required": ["title", "applicants", "reviews"],
+}
+GROUP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "minLength": 1},
+        "password": {"type": "string", "minLength": 1},
+        "icon": _NULLABLE_STRING,
+        "events": {"type": "array", "items": EVENT_SCHEMA},
+    },
+    "required": ["name", "password", "events"],
+}
+DOCUMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "version": {"const": DATA_VERSION},
+        "groups": {"type": "array", "items": GROUP_SCHEMA},
+    },
+    "required": ["version", "groups"],
+}
+
+
+class InvalidData(ValueError):
+    pass
+
+
+def _number(value, convert):
+    if value in ("", None):
+        return None
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        return value  # 変換できない値はそのまま残して検証でエラーにする
+
+
+# バージョン1 (サークルのリストだけ) → バージョン2
+# バージョン番号を付け、省略されていた項目を埋め、文字列の数値を変換する
+def _migrate_v1(groups):
+    for group in groups:
+        group.setdefault("icon", None)
+        group.setdefault("events", [])
+        for event in group["events"]:
+            for field in Event.FIELDS:
+                event.setdefault(field, None)
+            event["capacity"] = _number(event["capacity"], int)
+            event["latitude"] = _number(event["latitude"], float)
+            event["longitude"] = _number(event["longitude"], float)
+            event.setdefault("applicants", [])
+            event.setdefault("reviews", [])
+            for review in event["reviews"]:
+                review["satisfaction"] = _number(review.get("satisfaction"), int)
+                review.setdefault("feedback", "")
+    return {"version": 2, "groups": groups}
+
+
+# 古いバージョン → その次のバージョン への変換
+MIGRATIONS = {1: _migrate_v1}
+
+
+def migrate(document):
+    version = 1 if isinstance(document, list) else document.get("version")
+    while version != DATA_VERSION:
+        if version not in MIGRATIONS:
+            raise InvalidData(f"対応していないデータのバージョンです: {version}")
+        document = MIGRATIONS[version](document)
+        version = document["version"]
+    return document
+
+
+# groups.json を読み込み、最新の形式に変換して検証する
+@metrics.timed("models.load_document")
+def load_document(path):
+    import jsonschema  # 取り込み・書き出しのときだけ使うので、ここで読み込む
+    with open(path, "r", encoding="utf-8") as file:
+        document = migrate(json.load(file))
+    validator = jsonschema.Draft7Validator(DOCUMENT_SCHEMA, format_checker=jsonschema.Draft7Validator.FORMAT_CHECKER)
+    errors = sorted(validator.iter_errors(document), key=lambda e: list(e.path))
+    if errors:
+        raise InvalidData("\n".join(f"{'/'.join(str(p) for p in error.path)}: {error.message}" for error in errors))
+    return document
@@ -0,0 +1,127 @@
+import threading
+import unicodedata
+from collections import defaultdict
+
+# 検索対象のフィールドとランキングの重み
+FIELD_WEIGHTS = (
+    ("title", 3.0),
+    ("group_name", 2.0),
+    ("category", 2.0),
+    ("location", 1.5),
+    ("description", 1.0),
+)
+NGRAM = 2  # 文字 n-gram (分かち書きのない日本語でも部分一致できる)
+
+_EMPTY = frozenset()
+
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def ngrams(text, n=NGRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# 索引に登録する語: 文字 n-gram と1文字ずつ
+# (1文字の検索語は日本語では多い (例: 茶・会) ので、全件を調べずに引けるように1文字も登録する)
+def index_terms(text):
+    return ngrams(text) | set(text)
+
+
+# イベントの転置インデックス
+# フィールドごとに n-gram → イベントID の集合 を持ち、
+# 絞り込みもスコア計算も集合演算だけで行う (イベント1件ずつのループをしない)
+class SearchIndex:
+    def __init__(self, events=()):
+        self._postings = [defaultdict(set) for _ in FIELD_WEIGHTS]
+        self._docs = {}  # イベントID → 正規化済みフィールドのタプル
+        self._lock = threading.Lock()
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, event_id):
+        return event_id in self._docs
+
+    # 追加 (既に登録済みなら置き換える)
+    def add(self, event):
+        fields = tuple(_normalize(getattr(event, name)) for name, _ in FIELD_WEIGHTS)
+        with self._lock:
+            self._remove(event.id)
+            self._docs[event.id] = fields
+            for postings, field in zip(self._postings, fields):
+                for gram in index_terms(field):
+                    postings[gram].add(event.id)
+
+    update = add
+
+    def remove(self, event_id):
+        with self._lock:
+            self._remove(event_id)
+
+    def _remove(self, event_id):
+        fields = self._docs.pop(event_id, None)
+        if fields is None:
+            return
+        for postings, field in zip(self._postings, fields):
+            for gram in index_terms(field):
+                posting = postings.get(gram)
+                if posting is not None:
+                    posting.discard(event_id)
+                    if not posting:
+                        del postings[gram]
+
+    # 検索語を含むイベントの集合をフィールドごとに返す
+    def _field_matches(self, term):
+        grams = ngrams(term) or {term}  # 1文字だけの検索語は1文字の索引を引く
+        matches = []
+        for postings in self._postings:
+            sets = sorted((postings.get(gram, _EMPTY) for gram in grams), key=len)
+            matches.append(sets[0].intersection(*sets[1:]) if sets[0] else _EMPTY)
+        return matches
+
+    # 部分一致の確認 (n-gram がすべて含まれていても連続しているとは限らないため)
+    def _verify(self, event_id, terms):
+        fields = self._docs.get(event_id)
+        return fields is not None and all(any(term in field for field in fields) for term in terms)
+
+    # 空白区切りの各語をすべて含むイベントのIDをスコアの高い順に返す
+    # スコア = 各語について、その語を含むフィールドの重みの合計
+    def search(self, query, limit=None):
+        terms = _normalize(query).split()
+        if not terms:
+            return []
+        with self._lock:
+            buckets = None  # スコア → イベントIDの集合
+            for term in terms:
+                matches = self._field_matches(term)
+                matched = set().union(*matches)
+                if buckets is None:
+                    buckets = {0.0: matched}
+                else:
+                    buckets = {score: ids & matched for score, ids in buckets.items()}
+                for field_ids, (_, weight) in zip(matches, FIELD_WEIGHTS):
+                    if not field_ids:
+                        continue
+                    split = defaultdict(set)
+                    for score, ids in buckets.items():
+                        inside = ids & field_ids
+                        if inside:
+                            split[score + weight] |= inside
+                            ids = ids - inside
+                        if ids:
+                            split[score] |= ids
+                    buckets = split
+            # n-gram 以下の長さの語は索引の一致がそのまま部分一致なので確認を省く
+            verify = any(len(term) > NGRAM for term in terms)
+            results = []
+            for score in sorted(buckets, reverse=True):
+                for event_id in sorted(buckets[score]):
+                    if not verify or self._verify(event_id, terms):
+                        results.append(event_id)
+                        if limit is not None and len(results) >= limit:
+                            return results
+        return results
@@ -0,0 +1,206 @@
+import threading
+import time
+from types import MappingProxyType
+
+import metrics
+import storage
+from categories import CategoryIndex
+from changes import EVENT_DELETED, GROUP_ADDED, REVIEW_ADDED
+from dates import DateIndex
+from search import SearchIndex
+from spatial import GridIndex
+
+# インデックスの見え方をスナップショットに合わせる
+# インデックスは作り直さずに次のスナップショットへ引き継いで更新するので、
+# 古いスナップショットで描画中のセッションには、後から追加されたイベントのIDが返ることがある
+# 返すIDを自分のスナップショットにあるものだけに絞り、events_by_id で引けないIDを返さないようにする
+class _IndexView:
+    __slots__ = ("_index", "_events")
+
+    def __init__(self, index, events_by_id):
+        self._index = index
+        self._events = events_by_id
+
+    def _keep(self, event_ids):
+        events = self._events
+        return [event_id for event_id in event_ids if event_id in events]
+
+
+class _SearchView(_IndexView):
+    __slots__ = ()
+
+    def search(self, query, limit=None):
+        return self._keep(self._index.search(query, limit))
+
+
+class _SpatialView(_IndexView):
+    __slots__ = ()
+
+    def position(self, event_id):
+        return self._index.position(event_id) if event_id in self._events else None
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        return self._keep(self._index.query_bbox(min_lat, min_lon, max_lat, max_lon))
+
+    def query_radius(self, lat, lon, radius_km):
+        return [(distance, event_id) for distance, event_id in self._index.query_radius(lat, lon, radius_km)
+                if event_id in self._events]
+
+    def cluster(self, event_ids, max_points=500):
+        return self._index.cluster(self._keep(event_ids), max_points)
+
+
+class _CategoryView(_IndexView):
+    __slots__ = ()
+
+    def events(self, category, since=None):
+        return self._keep(self._index.events(category, since))
+
+    # 件数は索引の最新の値 (ジャンルの件数表示にだけ使うので、書き込み直後に数件ずれても再実行で揃う)
+    def counts(self, since=None):
+        return self._index.counts(since)
+
+
+class _DateView(_IndexView):
+    __slots__ = ()
+
+    def between(self, start=None, end=None):
+        return self._keep(self._index.between(start, end))
+
+    def count(self, start=None, end=None):
+        return len(self.between(start, end))
+
+    def upcoming(self, day=None):
+        return self._keep(self._index.upcoming(day))
+
+
+# プロセス全体で共有する読み込み専用のデータスナップショット
+# データバージョン (storage.data_version) が変わったときだけ DB から読み直す
+class Snapshot:
+    __slots__ = ("version", "groups", "events", "groups_by_name", "events_by_id", "events_by_group",
+                 "search", "spatial", "categories", "dates", "_indexes", "_catalog")
+
+    def __init__(self, version, groups, events, search, spatial, categories, dates, catalog=None):
+        self.version = version
+        self.groups = groups  # サークル (models.Group, パスワードは含まない)
+        self.events = events  # イベント (models.Event)
+        # 名前・IDからの逆引き
+        self.groups_by_name = MappingProxyType({group.name: group for group in groups})
+        self.events_by_id = MappingProxyType({event.id: event for event in events})
+        events_by_group = {}
+        for event in events:
+            events_by_group.setdefault(event.group_id, []).append(event)
+        self.events_by_group = MappingProxyType({group_id: tuple(group_events) for group_id, group_events in events_by_group.items()})
+        self._indexes = (search, spatial, categories, dates)
+        # 各インデックスはこのスナップショットにあるイベントのIDだけを返す
+        self.search = _SearchView(search, self.events_by_id)  # 全文検索インデックス
+        self.spatial = _SpatialView(spatial, self.events_by_id)  # 位置のグリッドインデックス
+        self.categories = _CategoryView(categories, self.events_by_id)  # カテゴリーごとのイベントの索引
+        self.dates = _DateView(dates, self.events_by_id)  # 開催日の索引
+        self._catalog = catalog
+
+    # イベントのインデックス (変更のあったイベントだけ更新して次のスナップショットに引き継ぐ)
+    def indexes(self):
+        return self._indexes
+
+    # 列指向のイベントテーブル (最初に使われたときに作る)
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            from catalog import build_catalog
+            self._catalog = build_catalog(self.events)
+        return self._catalog
+
+
+_lock = threading.Lock()
+_current = None
+_stats = {"hits": 0, "misses": 0, "delta_reloads": 0, "reload_seconds": 0.0, "last_reload_seconds": 0.0}
+
+
+_GROUP_CHANGES = {GROUP_ADDED, REVIEW_ADDED, EVENT_DELETED}  # サークルの一覧 (集計を含む) が変わる変更
+
+
+def _build(version, previous):
+    if previous is not None:
+        # 変更の記録で差分が分かれば (他のプロセスでの書き込みも含む)、変更のあったイベントだけを読み込む
+        changes = storage.changes_since(previous.version, version)
+        if changes is not None:
+            _stats["delta_reloads"] += 1
+            with metrics.timer("snapshot.delta"):
+                return _apply(version, previous, changes)
+    with metrics.timer("snapshot.full"):
+        return _build_full(version, previous)
+
+
+# 全体の読み直し (インデックスは前のスナップショットから引き継ぐ)
+def _build_full(version, previous):
+    events = tuple(storage.list_events())  # レコードは変更できないのでそのまま共有する
+    if previous is None:
+        indexes = (SearchIndex(events), GridIndex(events), CategoryIndex(events), DateIndex(events))
+    else:
+        # インデックスは作り直さず、変更のあったイベントだけ更新して引き継ぐ
+        indexes = previous.indexes()
+        old = previous.events_by_id
+        current_ids = set()
+        for event in events:
+            current_ids.add(event.id)
+            if old.get(event.id) != event:
+                for index in indexes:
+                    index.update(event)
+        for event_id in old.keys() - current_ids:
+            for index in indexes:
+                index.remove(event_id)
+    return Snapshot(version, tuple(storage.list_groups()), events, *indexes)
+
+
+def _apply(version, previous, changes):
+    event_ids = {change.event_id for change in changes if change.event_id is not None}
+    changed = storage.list_events_by_id(event_ids)
+    removed = event_ids - {event.id for event in changed}
+    events_by_id = dict(previous.events_by_id)
+    indexes = previous.indexes()
+    for event in changed:
+        events_by_id[event.id] = event
+        for index in indexes:
+            index.update(event)
+    for event_id in removed:
+        events_by_id.pop(event_id, None)
+        for index in indexes:
+            index.remove(event_id)
+    events = tuple(sorted(events_by_id.values(), key=lambda event: (event.group_id, event.id)))
+    if any(change.kind in _GROUP_CHANGES for change in changes):
+        groups = tuple(storage.list_groups())
+    else:
+        groups = previous.groups
+    catalog = None
+    if previous._catalog is not None:
+        from catalog import update_catalog
+        catalog = update_catalog(previous._catalog, changed, removed)
+    return Snapshot(version, groups, events, *indexes, catalog=catalog)
+
+
+def get_snapshot():
+    global _current
+    version = storage.data_version()
+    current = _current
+    if current is not None and current.version == version:
+        _stats["hits"] += 1
+        return current
+    with _lock:
+        # 待っている間に他のセッションが読み直していればそれを使う
+        if _current is not None and _current.version == version:
+            _stats["hits"] += 1
+            return _current
+        start = time.perf_counter()
+        _current = _build(version, _current)
+        elapsed = time.perf_counter() - start
+        _stats["misses"] += 1
+        _stats["reload_seconds"] += elapsed
+        _stats["last_reload_seconds"] = elapsed
+        return _current
+
+
+# キャッシュのヒット率と再読み込み時間
+def stats():
+    total = _stats["hits"] + _stats["misses"]
+    return dict(_stats, hit_rate=_stats["hits"] / total if total else 0.0)
@@ -0,0 +1,110 @@
+import math
+import threading
+from collections import defaultdict
+
+CELL_DEG = 0.01  # グリッドの1マスの大きさ (度, 緯度方向でおよそ1.1km)
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = 111.32  # 緯度1度あたりの距離
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+# イベントの位置のグリッドインデックス
+# 緯度・経度を CELL_DEG ごとのマスに分け、範囲検索では重なるマスだけを調べる
+class GridIndex:
+    def __init__(self, events=(), cell=CELL_DEG):
+        self.cell = cell
+        self._cells = defaultdict(dict)  # (緯度マス, 経度マス) → {イベントID: (緯度, 経度)}
+        self._points = {}  # イベントID → (緯度, 経度)
+        self._lock = threading.Lock()
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _key(self, lat, lon):
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    # 追加 (既に登録済みなら置き換える。座標のないイベントは登録しない)
+    def add(self, event):
+        with self._lock:
+            self._remove(event.id)
+            lat, lon = event.latitude, event.longitude
+            if lat is None or lon is None:
+                return
+            self._points[event.id] = (lat, lon)
+            self._cells[self._key(lat, lon)][event.id] = (lat, lon)
+
+    update = add
+
+    def remove(self, event_id):
+        with self._lock:
+            self._remove(event_id)
+
+    def _remove(self, event_id):
+        point = self._points.pop(event_id, None)
+        if point is None:
+            return
+        key = self._key(*point)
+        cell = self._cells[key]
+        cell.pop(event_id, None)
+        if not cell:
+            del self._cells[key]
+
+    def position(self, event_id):
+        return self._points.get(event_id)
+
+    # 範囲内のイベントID
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        lo_i, lo_j = self._key(min_lat, min_lon)
+        hi_i, hi_j = self._key(max_lat, max_lon)
+        with self._lock:
+            if (hi_i - lo_i + 1) * (hi_j - lo_j + 1) <= len(self._cells):
+                keys = ((i, j) for i in range(lo_i, hi_i + 1) for j in range(lo_j, hi_j + 1))
+            else:  # 範囲が広いときは登録のあるマスだけを見る
+                keys = [key for key in self._cells if lo_i <= key[0] <= hi_i and lo_j <= key[1] <= hi_j]
+            result = []
+            for key in keys:
+                cell = self._cells.get(key)
+                if cell:
+                    result.extend(event_id for event_id, (lat, lon) in cell.items()
+                                  if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon)
+        return result
+
+    # 中心から radius_km 以内のイベント: [(距離km, イベントID), ...] を近い順に返す
+    def query_radius(self, lat, lon, radius_km):
+        dlat = radius_km / KM_PER_DEG
+        dlon = radius_km / (KM_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+        result = []
+        for event_id in self.query_bbox(lat - dlat, lon - dlon, lat + dlat, lon + dlon):
+            point = self._points.get(event_id)
+            if point is None:
+                continue
+            distance = haversine_km(lat, lon, *point)
+            if distance <= radius_km:
+                result.append((distance, event_id))
+        result.sort()
+        return result
+
+    # 縮尺が小さいときの集約: 点を max_points 個程度以下のマスにまとめる
+    # 戻り値: [{"lat": 重心の緯度, "lon": 重心の経度, "count": 件数}, ...]
+    def cluster(self, event_ids, max_points=500):
+        points = [self._points[event_id] for event_id in event_ids if event_id in self._points]
+        if len(points) <= max_points:
+            return [{"lat": lat, "lon": lon, "count": 1} for lat, lon in points]
+        lats = [lat for lat, _ in points]
+        lons = [lon for _, lon in points]
+        span = max(max(lats) - min(lats), max(lons) - min(lons)) or self.cell
+        cell = span / math.sqrt(max_points)
+        sums = defaultdict(lambda: [0.0, 0.0, 0])
+        for lat, lon in points:
+            total = sums[(math.floor(lat / cell), math.floor(lon / cell))]
+            total[0] += lat
+            total[1] += lon
+            total[2] += 1
+        return [{"lat": lat / count, "lon": lon / count, "count": count} for lat, lon, count in sums.values()]
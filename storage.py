@@ -0,0 +1,748 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import changes
+import metrics
+from models import Applicant, Event, Group, Review, ReviewStats, load_document
+
+# 定数
+DB_FILE = os.environ.get("RALLY_DB_FILE", "data/groups.db")  # 複数のプロセスで動かすときは同じファイルを指定する
+DATA_FILE = "data/groups.json"  # 旧形式 (インポート元)
+BUSY_TIMEOUT = 30  # 書き込みロック待ちの上限 (秒)
+ARCHIVE_AFTER_DAYS = 30  # 開催日からこの日数が過ぎたイベントを保管用のテーブルに移す (その間はレビューを書ける)
+ARCHIVE_INTERVAL = 60 * 60  # 保管の処理を行う間隔 (秒)
+
+EVENT_FIELDS = list(Event.FIELDS)
+
+# スキーマのマイグレーション (データベースの user_version までは適用済み)
+# 新しい変更は末尾に追加する。user_version を持たない既存のデータベースにも
+# 先頭から適用できるよう、どれも何度実行しても同じ結果になるように書く
+MIGRATIONS = [
+    # 1: テーブルとインデックス
+    """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+CREATE TABLE IF NOT EXISTS groups (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    icon TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    description TEXT,
+    date TEXT,
+    location TEXT,
+    latitude REAL,
+    longitude REAL,
+    capacity INTEGER,
+    category TEXT
+);
+CREATE TABLE IF NOT EXISTS applicants (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    satisfaction INTEGER NOT NULL,
+    feedback TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_group ON events(group_id);
+CREATE INDEX IF NOT EXISTS idx_events_category ON events(category, date);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events(date);
+CREATE INDEX IF NOT EXISTS idx_applicants_event ON applicants(event_id, email);
+""",
+    # 2: レビューの重複を禁止
+    """
+-- レビューは1イベントにつき1メールアドレス1件 (一意インデックスで重複チェックも兼ねる)
+DELETE FROM reviews WHERE id NOT IN (SELECT MIN(id) FROM reviews GROUP BY event_id, email);
+DROP INDEX IF EXISTS idx_reviews_event;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_unique ON reviews(event_id, email);
+""",
+    # 3: レビューの集計
+    """
+-- イベントごとのレビューの集計 (件数・満足度の合計・満足度ごとの件数)
+-- レビューの追加・削除のたびにトリガーで差分だけ更新する
+CREATE TABLE IF NOT EXISTS review_stats (
+    event_id INTEGER PRIMARY KEY REFERENCES events(id) ON DELETE CASCADE,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    review_total INTEGER NOT NULL DEFAULT 0,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS reviews_stats_insert AFTER INSERT ON reviews BEGIN
+    INSERT OR IGNORE INTO review_stats (event_id) VALUES (NEW.event_id);
+    UPDATE review_stats SET
+        review_count = review_count + 1,
+        review_total = review_total + NEW.satisfaction,
+        rating_1 = rating_1 + (NEW.satisfaction = 1),
+        rating_2 = rating_2 + (NEW.satisfaction = 2),
+        rating_3 = rating_3 + (NEW.satisfaction = 3),
+        rating_4 = rating_4 + (NEW.satisfaction = 4),
+        rating_5 = rating_5 + (NEW.satisfaction = 5)
+    WHERE event_id = NEW.event_id;
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_stats_delete AFTER DELETE ON reviews BEGIN
+    UPDATE review_stats SET
+        review_count = review_count - 1,
+        review_total = review_total - OLD.satisfaction,
+        rating_1 = rating_1 - (OLD.satisfaction = 1),
+        rating_2 = rating_2 - (OLD.satisfaction = 2),
+        rating_3 = rating_3 - (OLD.satisfaction = 3),
+        rating_4 = rating_4 - (OLD.satisfaction = 4),
+        rating_5 = rating_5 - (OLD.satisfaction = 5)
+    WHERE event_id = OLD.event_id;
+END;
+-- 集計テーブルができる前のレビューを集計する (集計済みのイベントは飛ばす)
+INSERT OR IGNORE INTO review_stats
+SELECT event_id, COUNT(*), SUM(satisfaction),
+       SUM(satisfaction = 1), SUM(satisfaction = 2), SUM(satisfaction = 3), SUM(satisfaction = 4), SUM(satisfaction = 5)
+FROM reviews WHERE event_id NOT IN (SELECT event_id FROM review_stats) GROUP BY event_id;
+""",
+    # 4: 定員・キャンセル待ち
+    """
+-- 応募は1イベントにつき1メールアドレス1件 (一意インデックスで重複チェックも兼ねる)
+DELETE FROM applicants WHERE id NOT IN (SELECT MIN(id) FROM applicants GROUP BY event_id, email);
+DROP INDEX IF EXISTS idx_applicants_event;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_applicants_unique ON applicants(event_id, email);
+-- 定員を超えた応募者 (id の順に繰り上げる)
+CREATE TABLE IF NOT EXISTS waitlist (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_waitlist_unique ON waitlist(event_id, email);
+CREATE INDEX IF NOT EXISTS idx_waitlist_order ON waitlist(event_id, id);
+-- イベントごとの応募者数・キャンセル待ちの人数 (トリガーで差分だけ更新する)
+CREATE TABLE IF NOT EXISTS event_seats (
+    event_id INTEGER PRIMARY KEY REFERENCES events(id) ON DELETE CASCADE,
+    taken INTEGER NOT NULL DEFAULT 0,
+    waiting INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS applicants_seats_insert AFTER INSERT ON applicants BEGIN
+    INSERT OR IGNORE INTO event_seats (event_id) VALUES (NEW.event_id);
+    UPDATE event_seats SET taken = taken + 1 WHERE event_id = NEW.event_id;
+END;
+CREATE TRIGGER IF NOT EXISTS applicants_seats_delete AFTER DELETE ON applicants BEGIN
+    UPDATE event_seats SET taken = taken - 1 WHERE event_id = OLD.event_id;
+END;
+CREATE TRIGGER IF NOT EXISTS waitlist_seats_insert AFTER INSERT ON waitlist BEGIN
+    INSERT OR IGNORE INTO event_seats (event_id) VALUES (NEW.event_id);
+    UPDATE event_seats SET waiting = waiting + 1 WHERE event_id = NEW.event_id;
+END;
+CREATE TRIGGER IF NOT EXISTS waitlist_seats_delete AFTER DELETE ON waitlist BEGIN
+    UPDATE event_seats SET waiting = waiting - 1 WHERE event_id = OLD.event_id;
+END;
+INSERT OR IGNORE INTO event_seats (event_id, taken)
+SELECT event_id, COUNT(*) FROM applicants WHERE event_id NOT IN (SELECT event_id FROM event_seats) GROUP BY event_id;
+""",
+    # 5: 終了したイベントの保管 (一覧・スナップショットには読み込まない)
+    """
+CREATE TABLE IF NOT EXISTS archived_events (
+    id INTEGER PRIMARY KEY,
+    event_id INTEGER NOT NULL,  -- 保管前のイベントID
+    group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    description TEXT,
+    date TEXT,
+    location TEXT,
+    latitude REAL,
+    longitude REAL,
+    capacity INTEGER,
+    category TEXT,
+    archived_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_events_group ON archived_events(group_id);
+CREATE TABLE IF NOT EXISTS archived_applicants (
+    id INTEGER PRIMARY KEY,
+    archive_id INTEGER NOT NULL REFERENCES archived_events(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_applicants_event ON archived_applicants(archive_id);
+CREATE TABLE IF NOT EXISTS archived_reviews (
+    id INTEGER PRIMARY KEY,
+    archive_id INTEGER NOT NULL REFERENCES archived_events(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    satisfaction INTEGER NOT NULL,
+    feedback TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_archived_reviews_event ON archived_reviews(archive_id);
+-- 保管したイベントのレビューの集計 (サークルの評価には含め続ける)
+CREATE TABLE IF NOT EXISTS archived_review_stats (
+    group_id INTEGER PRIMARY KEY REFERENCES groups(id) ON DELETE CASCADE,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    review_total INTEGER NOT NULL DEFAULT 0,
+    rating_1 INTEGER NOT NULL DEFAULT 0,
+    rating_2 INTEGER NOT NULL DEFAULT 0,
+    rating_3 INTEGER NOT NULL DEFAULT 0,
+    rating_4 INTEGER NOT NULL DEFAULT 0,
+    rating_5 INTEGER NOT NULL DEFAULT 0
+);
+""",
+    # 6: 複数プロセスでの運用 (変更の記録・ログイン状態をプロセス間で共有する)
+    """
+-- データバージョンごとの変更 (kind が NULL の行は種類を記録しなかった書き込み)
+CREATE TABLE IF NOT EXISTS change_log (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    kind TEXT,
+    group_id INTEGER,
+    event_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_change_log_version ON change_log(version);
+-- ログイン状態 (トークンはハッシュ値だけを保存する)
+CREATE TABLE IF NOT EXISTS sessions (
+    token_hash TEXT PRIMARY KEY,
+    group_name TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at);
+""",
+    # 7: イベントIDを再利用しない (削除・保管したイベントのIDが新しいイベントに使われないように)
+    """
+-- AUTOINCREMENT を付けてテーブルを作り直す (マイグレーションは外部キーを無効にして実行するので、応募者などは消えない)
+CREATE TABLE IF NOT EXISTS events_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    description TEXT,
+    date TEXT,
+    location TEXT,
+    latitude REAL,
+    longitude REAL,
+    capacity INTEGER,
+    category TEXT
+);
+INSERT INTO events_new (id, group_id, title, description, date, location, latitude, longitude, capacity, category)
+SELECT id, group_id, title, description, date, location, latitude, longitude, capacity, category FROM events;
+DROP TABLE events;
+ALTER TABLE events_new RENAME TO events;
+CREATE INDEX IF NOT EXISTS idx_events_group ON events(group_id);
+CREATE INDEX IF NOT EXISTS idx_events_category ON events(category, date);
+CREATE INDEX IF NOT EXISTS idx_events_date ON events(date);
+-- 保管済み・削除済みのイベントのIDも使わないように、次のIDをそれより後にする
+INSERT INTO sqlite_sequence (name, seq) SELECT 'events', 0 WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'events');
+UPDATE sqlite_sequence SET seq = MAX(seq,
+    (SELECT COALESCE(MAX(event_id), 0) FROM archived_events),
+    (SELECT COALESCE(MAX(event_id), 0) FROM change_log)) WHERE name = 'events';
+""",
+]
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()
+
+# 接続先の切り替え (ベンチマークや CLI から使う)
+def configure(db_file, data_file=None):
+    global DB_FILE, DATA_FILE
+    DB_FILE = db_file
+    DATA_FILE = data_file
+
+# 接続管理 (スレッドごとに1接続)
+def connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == DB_FILE:
+        return conn
+    if os.path.dirname(DB_FILE):
+        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+    # isolation_level=None でトランザクションは transaction() が明示的に管理する
+    conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL: 読み込みは書き込みをブロックせず、書き込み途中のクラッシュでもファイルが壊れない
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    with _init_lock:
+        if DB_FILE not in _initialized:
+            init_db(conn)
+            _initialized.add(DB_FILE)
+    conn.execute("PRAGMA foreign_keys = ON")
+    _local.conn = conn
+    _local.path = DB_FILE
+    return conn
+
+# マイグレーションは外部キーを無効にした接続で行う
+# (テーブルを作り直すときに DROP TABLE で子の行が連鎖して削除されないように。SQLite の手順どおり最後に整合性を確認する)
+def init_db(conn):
+    conn.execute("PRAGMA foreign_keys = OFF")  # トランザクションの中では切り替えられない
+    with transaction(conn):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for script in MIGRATIONS[version:]:
+            _execute_script(conn, script)
+        if version < len(MIGRATIONS) and conn.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.IntegrityError("マイグレーション後のデータベースに外部キーの不整合があります")
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    with transaction(conn):
+        # 初回起動時のみ既存の groups.json を取り込む
+        # (複数プロセスが同時に起動しても、書き込みロック内で確認するので二重取り込みしない)
+        empty = conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0] == 0
+        if empty and DATA_FILE and os.path.exists(DATA_FILE):
+            import_json(DATA_FILE, conn)
+
+# トリガーの本体にも ";" があるので、文が完結するところで区切って実行する
+# (executescript はトランザクションを確定してしまうので使わない)
+def _execute_script(conn, script):
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            conn.execute(statement)
+            statement = ""
+
+# 書き込みトランザクション
+# BEGIN IMMEDIATE で最初に書き込みロックを取るので、同時に送信されても
+# 読み込み→書き込みの途中で他のセッションの更新が失われることはない
+# 変更があった場合はデータバージョンを1つ進め (キャッシュの無効化に使う)、
+# 中で記録された変更を同じトランザクションで change_log に書き (他のプロセス向け)、
+# 確定後に変更フィードに publish する (同じプロセス向け)
+@contextmanager
+def transaction(conn=None):
+    conn = conn or connect()
+    if conn.in_transaction:  # 入れ子の場合は外側のトランザクションに含める
+        yield conn
+        return
+    start = time.perf_counter()  # 書き込みロックの待ち時間も含める
+    conn.execute("BEGIN IMMEDIATE")
+    before = conn.total_changes
+    _local.pending = []
+    version = None
+    try:
+        yield conn
+        if conn.total_changes != before:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            _log_changes(conn, version, _local.pending)
+    except BaseException:
+        _local.pending = []
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    if metrics.ENABLED:
+        metrics.observe("storage.write", time.perf_counter() - start)
+    pending, _local.pending = _local.pending, []
+    if version is not None:
+        # 変更の種類を記録しなかった書き込み (一括登録など) は空の一覧になり、読み込む側は全体を読み直す
+        changes.FEED.publish(version, pending)
+
+# 変更の記録 (トランザクションの中で呼ぶ)
+def _emit(kind, group_id=None, event_id=None):
+    _local.pending.append(changes.Change(kind=kind, group_id=group_id, event_id=event_id))
+
+def _log_changes(conn, version, pending):
+    conn.executemany(
+        "INSERT INTO change_log (version, kind, group_id, event_id) VALUES (?, ?, ?, ?)",
+        [(version, change.kind, change.group_id, change.event_id) for change in pending] or [(version, None, None, None)]
+    )
+    conn.execute("DELETE FROM change_log WHERE version <= ?", (version - changes.MAX_VERSIONS,))
+
+# version より後、until までの変更の一覧 (changes.ChangeFeed.since と同じく、分からなければ None)
+# 同じプロセスの変更フィードで分からなければ (他のプロセスで書き込まれたとき) change_log から読む
+def changes_since(version, until):
+    found = changes.FEED.since(version, until)
+    if found is not None or until - version > changes.MAX_VERSIONS:
+        return found
+    rows = connect().execute(
+        "SELECT version, kind, group_id, event_id FROM change_log WHERE version > ? AND version <= ? ORDER BY id",
+        (version, until)
+    ).fetchall()
+    if {row[0] for row in rows} != set(range(version + 1, until + 1)) or any(row[1] is None for row in rows):
+        return None
+    return [changes.Change(kind=kind, group_id=group_id, event_id=event_id) for _, kind, group_id, event_id in rows]
+
+# データバージョン (書き込みのたびに増える)
+def data_version():
+    return connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+# groups.json からの一括インポート (古い形式は変換し、スキーマで検証してから書き込む)
+@metrics.timed("storage.import_json")
+def import_json(json_path, conn=None):
+    conn = conn or connect()
+    groups = load_document(json_path)["groups"]
+    with transaction(conn):
+        for group in groups:
+            group_id = conn.execute(
+                "INSERT INTO groups (name, password, icon) VALUES (?, ?, ?)",
+                (group["name"], group["password"], group["icon"])
+            ).lastrowid
+            for event in group["events"]:
+                event_id = _insert_event(conn, group_id, event)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO applicants (event_id, name, email) VALUES (?, ?, ?)",
+                    [(event_id, a["name"], a["email"]) for a in event["applicants"]]
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO reviews (event_id, name, email, satisfaction, feedback) VALUES (?, ?, ?, ?, ?)",
+                    [(event_id, r["name"], r["email"], r["satisfaction"], r["feedback"]) for r in event["reviews"]]
+                )
+    return len(groups)
+
+def _insert_event(conn, group_id, event):
+    return conn.execute(
+        f"INSERT INTO events (group_id, {', '.join(EVENT_FIELDS)}) VALUES (?, {', '.join('?' for _ in EVENT_FIELDS)})",
+        [group_id] + [event.get(field) for field in EVENT_FIELDS]
+    ).lastrowid
+
+def _records(cls, cursor):
+    return [cls.from_row(row) for row in cursor.fetchall()]
+
+def _record(cls, cursor):
+    row = cursor.fetchone()
+    return cls.from_row(row) if row else None
+
+# サークル関連
+# レビューの集計列 (review_stats の列をそのまま使う)
+_STATS_COLUMNS = ReviewStats.STATS_FIELDS
+
+@metrics.timed("storage.list_groups")
+def list_groups():
+    # 保管済みのイベントのレビューも含めて集計する
+    return _records(Group, connect().execute(
+        f"SELECT g.id, g.name, g.icon, {', '.join(f'COALESCE(s.{c}, 0) + COALESCE(a.{c}, 0) AS {c}' for c in _STATS_COLUMNS)} "
+        f"FROM groups g LEFT JOIN (SELECT e.group_id, {', '.join(f'SUM(r.{c}) AS {c}' for c in _STATS_COLUMNS)} "
+        "FROM review_stats r JOIN events e ON e.id = r.event_id GROUP BY e.group_id) s ON s.group_id = g.id "
+        "LEFT JOIN archived_review_stats a ON a.group_id = g.id "
+        "ORDER BY g.id"
+    ))
+
+def get_group(name):
+    return _record(Group, connect().execute("SELECT * FROM groups WHERE name = ?", (name,)))
+
+# 同じ名前のサークルが既にあれば None を返す
+def add_group(name, password, icon=None):
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO groups (name, password, icon) VALUES (?, ?, ?)", (name, password, icon)
+        )
+        if not cursor.rowcount:
+            return None
+        _emit(changes.GROUP_ADDED, group_id=cursor.lastrowid)
+        return cursor.lastrowid
+
+# イベント関連
+_EVENT_QUERY = (
+    f"SELECT e.*, g.name AS group_name, g.icon AS group_icon, {', '.join(f'COALESCE(r.{c}, 0) AS {c}' for c in _STATS_COLUMNS)}, "
+    "COALESCE(s.taken, 0) AS applicant_count, COALESCE(s.waiting, 0) AS waitlist_count "
+    "FROM events e JOIN groups g ON g.id = e.group_id LEFT JOIN review_stats r ON r.event_id = e.id "
+    "LEFT JOIN event_seats s ON s.event_id = e.id "
+)
+
+@metrics.timed("storage.list_events")
+def list_events():
+    return _records(Event, connect().execute(_EVENT_QUERY + "ORDER BY g.id, e.id"))
+
+# 指定したIDのイベント (削除済みのものは含まれない)
+@metrics.timed("storage.list_events_by_id")
+def list_events_by_id(event_ids):
+    event_ids = list(event_ids)
+    if not event_ids:
+        return []
+    return _records(Event, connect().execute(
+        _EVENT_QUERY + f"WHERE e.id IN ({', '.join('?' for _ in event_ids)})", event_ids
+    ))
+
+def get_event(event_id):
+    return _record(Event, connect().execute("SELECT * FROM events WHERE id = ?", (event_id,)))
+
+def add_event(group_id, event):
+    with transaction() as conn:
+        event_id = _insert_event(conn, group_id, event)
+        _emit(changes.EVENT_ADDED, group_id=group_id, event_id=event_id)
+        return event_id
+
+def update_event(event_id, fields):
+    columns = [field for field in EVENT_FIELDS if field in fields]
+    with transaction() as conn:
+        conn.execute(
+            f"UPDATE events SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+            [fields[c] for c in columns] + [event_id]
+        )
+        _emit(changes.EVENT_UPDATED, event_id=event_id)
+        _promote(conn, event_id)  # 定員が増えた場合はキャンセル待ちを繰り上げる
+
+def delete_event(event_id):
+    with transaction() as conn:
+        conn.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        _emit(changes.EVENT_DELETED, event_id=event_id)
+
+# 終了したイベントの保管
+# 開催日が before より前のイベントを、応募者・レビューとともに保管用のテーブルに移す
+# (キャンセル待ちは不要なので削除する)。保管したイベントは一覧・スナップショットに読み込まれない
+# 移したイベントは削除として変更フィードに流れるので、スナップショットは差分だけを更新する
+@metrics.timed("storage.archive_events")
+def archive_events(before=None):
+    before = before or (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    with transaction() as conn:
+        rows = conn.execute("SELECT id, group_id FROM events WHERE date < ?", (before,)).fetchall()
+        if not rows:
+            return 0
+        archived_at = date.today().isoformat()
+        conn.execute(
+            f"INSERT INTO archived_review_stats (group_id, {', '.join(_STATS_COLUMNS)}) "
+            f"SELECT e.group_id, {', '.join(f'SUM(r.{c})' for c in _STATS_COLUMNS)} "
+            "FROM review_stats r JOIN events e ON e.id = r.event_id WHERE e.date < ? GROUP BY e.group_id "
+            f"ON CONFLICT (group_id) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in _STATS_COLUMNS)}",
+            (before,)
+        )
+        for event_id, group_id in rows:
+            archive_id = conn.execute(
+                f"INSERT INTO archived_events (event_id, group_id, {', '.join(EVENT_FIELDS)}, archived_at) "
+                f"SELECT id, group_id, {', '.join(EVENT_FIELDS)}, ? FROM events WHERE id = ?",
+                (archived_at, event_id)
+            ).lastrowid
+            conn.execute(
+                "INSERT INTO archived_applicants (archive_id, name, email) "
+                "SELECT ?, name, email FROM applicants WHERE event_id = ? ORDER BY id", (archive_id, event_id)
+            )
+            conn.execute(
+                "INSERT INTO archived_reviews (archive_id, name, email, satisfaction, feedback) "
+                "SELECT ?, name, email, satisfaction, feedback FROM reviews WHERE event_id = ? ORDER BY id",
+                (archive_id, event_id)
+            )
+            _emit(changes.EVENT_DELETED, group_id=group_id, event_id=event_id)
+        conn.execute("DELETE FROM events WHERE date < ?", (before,))  # 応募者・レビュー・集計も一緒に消える
+        return len(rows)
+
+_archiver_started = False
+
+# 定期的に保管の処理を行うスレッドを起動する (プロセスごとに1回だけ)
+# 複数のプロセスで同時に動いても、書き込みロックの中で対象を選ぶので二重に保管しない
+def start_archiver(interval=ARCHIVE_INTERVAL):
+    global _archiver_started
+    with _init_lock:
+        if _archiver_started:
+            return
+        _archiver_started = True
+
+    def run():
+        while True:
+            try:
+                archive_events()
+            except sqlite3.Error:
+                pass  # 次の回にやり直す
+            time.sleep(interval)
+
+    threading.Thread(target=run, name="archiver", daemon=True).start()
+
+# ログイン状態 (どのプロセスからも確認できるようにデータベースに置く)
+# データバージョンは進めない (スナップショットを読み直させない) ので transaction() は使わず、1文ずつ確定する
+def add_session(token_hash, group_name, expires_at):
+    conn = connect()
+    conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))  # 期限切れのものを片付ける
+    conn.execute("INSERT INTO sessions (token_hash, group_name, expires_at) VALUES (?, ?, ?)",
+                 (token_hash, group_name, expires_at))
+
+# 期限切れ・不明なら None
+def get_session(token_hash):
+    row = connect().execute(
+        "SELECT group_name FROM sessions WHERE token_hash = ? AND expires_at >= ?", (token_hash, time.time())
+    ).fetchone()
+    return row[0] if row else None
+
+def delete_session(token_hash):
+    connect().execute("DELETE FROM sessions WHERE token_hash = ?", (token_hash,))
+
+# 応募者関連
+@metrics.timed("storage.list_applicants")
+def list_applicants(event_id):
+    return _records(Applicant, connect().execute(
+        "SELECT event_id, name, email FROM applicants WHERE event_id = ? ORDER BY id", (event_id,)
+    ))
+
+@metrics.timed("storage.get_applicant")
+def get_applicant(event_id, email):
+    return _record(Applicant, connect().execute(
+        "SELECT event_id, name, email FROM applicants WHERE event_id = ? AND email = ?", (event_id, email)
+    ))
+
+@metrics.timed("storage.list_waitlist")
+def list_waitlist(event_id):
+    return _records(Applicant, connect().execute(
+        "SELECT event_id, name, email FROM waitlist WHERE event_id = ? ORDER BY id", (event_id,)
+    ))
+
+# 応募の結果
+APPLIED = "applied"  # 応募を受け付けた
+WAITLISTED = "waitlisted"  # 定員に達していたのでキャンセル待ちに追加した
+DUPLICATE = "duplicate"  # 同じメールアドレスで応募済み (キャンセル待ちを含む)
+NOT_FOUND = "not_found"  # イベントが削除・保管されていた
+
+# 応募: 空席があれば応募者に、なければキャンセル待ちに追加する
+# BEGIN IMMEDIATE の中で確認と確保を行うので、同時に応募されても定員を超えない
+def add_applicant(event_id, name, email):
+    with transaction() as conn:
+        return _add_applicant(conn, event_id, name, email)
+
+def _add_applicant(conn, event_id, name, email):
+    if conn.execute(
+        "SELECT 1 FROM applicants WHERE event_id = ? AND email = ? UNION ALL "
+        "SELECT 1 FROM waitlist WHERE event_id = ? AND email = ?", (event_id, email, event_id, email)
+    ).fetchone():
+        return DUPLICATE
+    # 空席の確認と確保を1つの文で行う (応募者数は event_seats のカウンタを見るので数え直さない)
+    if conn.execute(
+        "INSERT INTO applicants (event_id, name, email) SELECT e.id, ?, ? FROM events e "
+        "LEFT JOIN event_seats s ON s.event_id = e.id "
+        "WHERE e.id = ? AND (e.capacity IS NULL OR COALESCE(s.taken, 0) < e.capacity)", (name, email, event_id)
+    ).rowcount:
+        _emit(changes.APPLICANT_ADDED, event_id=event_id)
+        return APPLIED
+    # 追加されなかったのは満席か、イベントがもうないか (表示中に削除・保管されることがある)
+    if not conn.execute("SELECT 1 FROM events WHERE id = ?", (event_id,)).fetchone():
+        return NOT_FOUND
+    conn.execute("INSERT INTO waitlist (event_id, name, email) VALUES (?, ?, ?)", (event_id, name, email))
+    _emit(changes.WAITLIST_ADDED, event_id=event_id)
+    return WAITLISTED
+
+# 応募の取り消し (管理者): 空いた席にはキャンセル待ちを先着順で繰り上げる
+# 戻り値: 繰り上がった応募者のリスト (取り消す応募がなければ None)
+def remove_applicant(event_id, email):
+    with transaction() as conn:
+        if not conn.execute("DELETE FROM applicants WHERE event_id = ? AND email = ?", (event_id, email)).rowcount:
+            return None
+        _emit(changes.APPLICANT_REMOVED, event_id=event_id)
+        return _promote(conn, event_id)
+
+def _promote(conn, event_id):
+    promoted = []
+    while True:
+        row = conn.execute(
+            "SELECT w.id, w.name, w.email FROM waitlist w JOIN events e ON e.id = w.event_id "
+            "LEFT JOIN event_seats s ON s.event_id = e.id "
+            "WHERE w.event_id = ? AND (e.capacity IS NULL OR COALESCE(s.taken, 0) < e.capacity) ORDER BY w.id LIMIT 1",
+            (event_id,)
+        ).fetchone()
+        if row is None:
+            break
+        conn.execute("DELETE FROM waitlist WHERE id = ?", (row[0],))
+        conn.execute("INSERT INTO applicants (event_id, name, email) VALUES (?, ?, ?)", (event_id, row[1], row[2]))
+        promoted.append(Applicant(event_id=event_id, name=row[1], email=row[2]))
+    if promoted:
+        _emit(changes.APPLICANT_ADDED, event_id=event_id)
+    return promoted
+
+# レビュー関連
+# limit を指定すると offset 件目から limit 件だけ読み込む (ページごとの表示用)
+@metrics.timed("storage.list_reviews")
+def list_reviews(event_id, limit=None, offset=0):
+    return _records(Review, connect().execute(
+        "SELECT event_id, name, email, satisfaction, feedback FROM reviews WHERE event_id = ? ORDER BY id LIMIT ? OFFSET ?",
+        (event_id, -1 if limit is None else limit, offset)
+    ))
+
+@metrics.timed("storage.has_review")
+def has_review(event_id, email):
+    return connect().execute(
+        "SELECT 1 FROM reviews WHERE event_id = ? AND email = ? LIMIT 1", (event_id, email)
+    ).fetchone() is not None
+
+# 一括登録 (CLI から使う。1回の呼び出しを1トランザクションで書き込む)
+# 戻り値: 登録した件数 (既にある同名のサークルは飛ばす)
+def add_groups(groups):
+    with transaction() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO groups (name, password, icon) VALUES (?, ?, ?)",
+            [(group["name"], group["password"], group.get("icon")) for group in groups]
+        )
+        return conn.total_changes - before
+
+def add_events(events):
+    with transaction() as conn:
+        conn.executemany(
+            f"INSERT INTO events (group_id, {', '.join(EVENT_FIELDS)}) VALUES (?, {', '.join('?' for _ in EVENT_FIELDS)})",
+            [[event["group_id"]] + [event.get(field) for field in EVENT_FIELDS] for event in events]
+        )
+        return len(events)
+
+# 戻り値: 応募ごとの結果 (APPLIED / WAITLISTED / DUPLICATE / NOT_FOUND) のリスト
+def add_applicants(applicants):
+    with transaction() as conn:
+        return [_add_applicant(conn, a["event_id"], a["name"], a["email"]) for a in applicants]
+
+# サークル名 → ID (見つからない名前は含まれない)
+def group_ids(names):
+    names = list(set(names))
+    if not names:
+        return {}
+    return dict(connect().execute(
+        f"SELECT name, id FROM groups WHERE name IN ({', '.join('?' for _ in names)})", names
+    ).fetchall())
+
+def event_ids(ids):
+    ids = list(set(ids))
+    if not ids:
+        return set()
+    return {row[0] for row in connect().execute(
+        f"SELECT id FROM events WHERE id IN ({', '.join('?' for _ in ids)})", ids
+    )}
+
+# 一括書き出し: 全件をメモリに載せず chunk_size 行ずつ読み込んで1行ずつ返す
+EXPORT_QUERIES = {
+    "groups": "SELECT id, name, icon FROM groups ORDER BY id",
+    "events": f"SELECT e.id, g.name AS group_name, {', '.join(f'e.{field}' for field in EVENT_FIELDS)} "
+              "FROM events e JOIN groups g ON g.id = e.group_id ORDER BY e.id",
+    "applicants": "SELECT a.event_id, e.title AS event_title, a.name, a.email "
+                  "FROM applicants a JOIN events e ON e.id = a.event_id ORDER BY a.event_id, a.id",
+    "reviews": "SELECT r.event_id, e.title AS event_title, r.name, r.email, r.satisfaction, r.feedback "
+               "FROM reviews r JOIN events e ON e.id = r.event_id ORDER BY r.event_id, r.id",
+    "archived_events": f"SELECT a.event_id AS id, g.name AS group_name, {', '.join(f'a.{field}' for field in EVENT_FIELDS)}, "
+                       "a.archived_at FROM archived_events a JOIN groups g ON g.id = a.group_id ORDER BY a.id",
+    "archived_applicants": "SELECT e.event_id, e.title AS event_title, a.name, a.email "
+                           "FROM archived_applicants a JOIN archived_events e ON e.id = a.archive_id ORDER BY a.archive_id, a.id",
+    "archived_reviews": "SELECT e.event_id, e.title AS event_title, r.name, r.email, r.satisfaction, r.feedback "
+                        "FROM archived_reviews r JOIN archived_events e ON e.id = r.archive_id ORDER BY r.archive_id, r.id",
+}
+
+def iter_export(kind, chunk_size=1000):
+    connect()  # スキーマの作成・初回インポートを済ませておく
+    # 書き出し専用の接続を使う (読み込み途中に同じスレッドで書き込みがあっても影響しない)
+    conn = sqlite3.connect(DB_FILE, timeout=BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.execute(EXPORT_QUERIES[kind])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        conn.close()
+
+# レビューの結果 (DUPLICATE・NOT_FOUND は応募と共通)
+ADDED = "added"  # レビューを受け付けた
+
+# レビューの投稿: 投稿済みなら DUPLICATE、イベントが削除・保管されていれば NOT_FOUND を返す
+# (INSERT OR IGNORE は外部キー違反を無視しないので、イベントがあるかを先に確認する)
+def add_review(event_id, name, email, satisfaction, feedback):
+    with transaction() as conn:
+        if not conn.execute("SELECT 1 FROM events WHERE id = ?", (event_id,)).fetchone():
+            return NOT_FOUND
+        added = conn.execute(
+            "INSERT OR IGNORE INTO reviews (event_id, name, email, satisfaction, feedback) VALUES (?, ?, ?, ?, ?)",
+            (event_id, name, email, satisfaction, feedback)
+        ).rowcount == 1
+        if not added:
+            return DUPLICATE
+        _emit(changes.REVIEW_ADDED, event_id=event_id)
+        return ADDED
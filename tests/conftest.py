@@ -0,0 +1,23 @@
+# テストの共通処理
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import snapshot
+import storage
+
+
+# 空の一時データベースを使う (groups.json は取り込まない)
+@pytest.fixture
+def db(tmp_path):
+    storage.configure(str(tmp_path / "groups.db"))
+    snapshot._current = None  # 前のテストのスナップショットを引き継がない
+    yield storage
+    snapshot._current = None
+
+
+def make_event(title="イベント", date="2099-04-01", capacity=None, category="勉強会"):
+    return {"title": title, "description": "説明", "date": date, "location": "東京駅",
+            "latitude": 35.6812, "longitude": 139.7671, "capacity": capacity, "category": category}
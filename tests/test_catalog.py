@@ -0,0 +1,28 @@
+# 列指向のイベントテーブル (catalog.py) のテスト
+from conftest import make_event
+from snapshot import get_snapshot
+
+
+def test_update_keeps_dtypes_after_removal_only(db):
+    group_id = db.add_group("テストサークル", "x")
+    first = db.add_event(group_id, make_event("一つ目", capacity=10))
+    db.add_event(group_id, make_event("二つ目", capacity=20))
+    db.add_review(first, "佐藤", "sato@example.ac.jp", 5, "")
+    dtypes = get_snapshot().catalog.dtypes
+    db.delete_event(first)
+    catalog = get_snapshot().catalog
+    assert list(catalog.index) == [first + 1]
+    assert catalog.dtypes.to_dict() == dtypes.to_dict()
+
+
+def test_update_keeps_dtypes_after_change(db):
+    group_id = db.add_group("テストサークル", "x")
+    first = db.add_event(group_id, make_event("一つ目", capacity=10))
+    second = db.add_event(group_id, make_event("二つ目", capacity=20))
+    dtypes = get_snapshot().catalog.dtypes
+    db.delete_event(first)
+    get_snapshot().catalog
+    db.update_event(second, {"title": "二つ目 (変更)"})
+    catalog = get_snapshot().catalog
+    assert catalog.loc[second, "title"] == "二つ目 (変更)"
+    assert catalog.dtypes.to_dict() == dtypes.to_dict()
@@ -0,0 +1,36 @@
+# 起動時間の予算のテスト (bench/import_time.py と同じ計測を使う)
+#
+#   python -m pytest tests
+import os
+import statistics
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+import import_time
+from harness import run_isolated
+
+RUNS = 3  # import app を計測する回数 (中央値を使う)
+
+
+@pytest.fixture(scope="module")
+def import_runs():
+    return [import_time.measure_import() for _ in range(RUNS)]
+
+
+def test_import_app_within_budget(import_runs):
+    own = statistics.median(total - streamlit for total, streamlit, _ in import_runs)
+    assert own * 1000 <= import_time.BUDGET_MS, f"import app: {own * 1000:.1f} ms (予算 {import_time.BUDGET_MS} ms)"
+
+
+def test_import_app_loads_no_heavy_modules(import_runs):
+    heavy = set().union(*(heavy for _, _, heavy in import_runs))
+    assert not heavy, f"import app で重いモジュールを読み込んでいます: {sorted(heavy)}"
+
+
+@pytest.mark.parametrize("tab", list(import_time.TAB_MODULES))
+def test_tab_loads_only_what_it_needs(tab):
+    loaded = set(run_isolated(import_time.measure_tab, tab, 5, 5))
+    unexpected = loaded - import_time.TAB_MODULES[tab]
+    assert not unexpected, f"{tab}: 予定にないモジュールを読み込んでいます: {sorted(unexpected)}"
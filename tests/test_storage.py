@@ -0,0 +1,154 @@
+# データベース (storage.py) のテスト
+# 定員・キャンセル待ち・レビュー・保管・マイグレーションを一時ファイルのデータベースで確認する
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+from conftest import make_event
+
+
+@pytest.fixture
+def group_id(db):
+    return db.add_group("テストサークル", "x")
+
+
+def seats(event_id):
+    event = storage.list_events_by_id([event_id])[0]
+    return event.applicant_count, event.waitlist_count
+
+
+def emails(records):
+    return [record.email for record in records]
+
+
+# 応募・キャンセル待ち
+def test_apply_reserves_seats_then_waitlists(group_id):
+    event_id = storage.add_event(group_id, make_event(capacity=2))
+    results = [storage.add_applicant(event_id, "名前", f"user{i}@example.ac.jp") for i in range(4)]
+    assert results == [storage.APPLIED, storage.APPLIED, storage.WAITLISTED, storage.WAITLISTED]
+    assert seats(event_id) == (2, 2)
+    assert storage.list_events_by_id([event_id])[0].seats_left == 0
+
+
+def test_concurrent_applications_do_not_exceed_capacity(group_id):
+    event_id = storage.add_event(group_id, make_event(capacity=5))
+    results = []
+
+    def apply(i):
+        results.append(storage.add_applicant(event_id, "名前", f"user{i}@example.ac.jp"))
+
+    threads = [threading.Thread(target=apply, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(storage.APPLIED) == 5
+    assert results.count(storage.WAITLISTED) == 15
+    assert seats(event_id) == (5, 15)
+    assert len(storage.list_applicants(event_id)) == 5
+
+
+def test_duplicate_email_is_rejected_in_applicants_and_waitlist(group_id):
+    event_id = storage.add_event(group_id, make_event(capacity=1))
+    assert storage.add_applicant(event_id, "名前", "a@example.ac.jp") == storage.APPLIED
+    assert storage.add_applicant(event_id, "名前", "b@example.ac.jp") == storage.WAITLISTED
+    assert storage.add_applicant(event_id, "名前", "a@example.ac.jp") == storage.DUPLICATE
+    assert storage.add_applicant(event_id, "名前", "b@example.ac.jp") == storage.DUPLICATE
+    assert seats(event_id) == (1, 1)
+
+
+def test_remove_applicant_promotes_waitlist_in_order(group_id):
+    event_id = storage.add_event(group_id, make_event(capacity=1))
+    for email in ("a@example.ac.jp", "b@example.ac.jp", "c@example.ac.jp"):
+        storage.add_applicant(event_id, "名前", email)
+    assert emails(storage.remove_applicant(event_id, "a@example.ac.jp")) == ["b@example.ac.jp"]
+    assert emails(storage.list_applicants(event_id)) == ["b@example.ac.jp"]
+    assert emails(storage.list_waitlist(event_id)) == ["c@example.ac.jp"]
+    assert storage.remove_applicant(event_id, "a@example.ac.jp") is None  # 取り消す応募がない
+    assert seats(event_id) == (1, 1)
+
+
+def test_capacity_increase_promotes_waitlist_in_order(group_id):
+    event_id = storage.add_event(group_id, make_event(capacity=1))
+    for email in ("a@example.ac.jp", "b@example.ac.jp", "c@example.ac.jp", "d@example.ac.jp"):
+        storage.add_applicant(event_id, "名前", email)
+    storage.update_event(event_id, {"capacity": 3})
+    assert emails(storage.list_applicants(event_id)) == ["a@example.ac.jp", "b@example.ac.jp", "c@example.ac.jp"]
+    assert emails(storage.list_waitlist(event_id)) == ["d@example.ac.jp"]
+    assert seats(event_id) == (3, 1)
+
+
+def test_apply_to_deleted_event_is_not_found(group_id):
+    event_id = storage.add_event(group_id, make_event(capacity=1))
+    storage.delete_event(event_id)
+    assert storage.add_applicant(event_id, "名前", "a@example.ac.jp") == storage.NOT_FOUND
+    assert storage.add_applicants([{"event_id": event_id, "name": "名前", "email": "b@example.ac.jp"}]) == [storage.NOT_FOUND]
+
+
+# レビュー
+def test_review_added_duplicate_and_not_found(group_id):
+    event_id = storage.add_event(group_id, make_event())
+    assert storage.add_review(event_id, "名前", "a@example.ac.jp", 4, "よかった") == storage.ADDED
+    assert storage.add_review(event_id, "名前", "a@example.ac.jp", 1, "二回目") == storage.DUPLICATE
+    event = storage.list_events_by_id([event_id])[0]
+    assert (event.review_count, event.review_total) == (1, 4)
+    storage.delete_event(event_id)
+    assert storage.add_review(event_id, "名前", "b@example.ac.jp", 5, "") == storage.NOT_FOUND
+
+
+# 保管
+def test_archive_moves_rows_and_keeps_group_stats(group_id):
+    old = storage.add_event(group_id, make_event("終わった", date="2000-01-01", capacity=1))
+    new = storage.add_event(group_id, make_event("これから", date="2099-01-01"))
+    storage.add_applicant(old, "名前", "a@example.ac.jp")
+    storage.add_applicant(old, "名前", "b@example.ac.jp")  # キャンセル待ちは保管しない
+    storage.add_review(old, "名前", "a@example.ac.jp", 5, "")
+    storage.add_review(new, "名前", "a@example.ac.jp", 3, "")
+
+    assert storage.archive_events(before="2001-01-01") == 1
+    assert [event.id for event in storage.list_events()] == [new]
+    assert [row["id"] for row in storage.iter_export("archived_events")] == [old]
+    assert [row["email"] for row in storage.iter_export("archived_applicants")] == ["a@example.ac.jp"]
+    assert [row["satisfaction"] for row in storage.iter_export("archived_reviews")] == [5]
+    group = storage.list_groups()[0]
+    assert (group.review_count, group.review_total) == (2, 8)  # 保管したイベントのレビューも含める
+    assert storage.archive_events(before="2001-01-01") == 0
+
+
+def test_deleted_and_archived_event_ids_are_not_reused(group_id):
+    deleted = storage.add_event(group_id, make_event())
+    storage.delete_event(deleted)
+    archived = storage.add_event(group_id, make_event(date="2000-01-01"))
+    storage.archive_events(before="2001-01-01")
+    assert storage.add_event(group_id, make_event()) > max(deleted, archived)
+
+
+# マイグレーション 7 (events を AUTOINCREMENT 付きで作り直す) を user_version 6 のデータベースに適用する
+def test_migration_rebuilds_events_from_version_6(tmp_path, db):
+    path = str(tmp_path / "v6.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    for script in storage.MIGRATIONS[:6]:
+        storage._execute_script(conn, script)
+    conn.execute("PRAGMA user_version = 6")
+    conn.execute("INSERT INTO groups (id, name, password) VALUES (1, 'テストサークル', 'x')")
+    conn.execute("INSERT INTO events (id, group_id, title, capacity) VALUES (1, 1, '残る', 1), (2, 1, '満席', 1)")
+    conn.execute("INSERT INTO applicants (event_id, name, email) VALUES (1, '名前', 'a@example.ac.jp'), "
+                 "(2, '名前', 'a@example.ac.jp')")
+    conn.execute("INSERT INTO waitlist (event_id, name, email) VALUES (2, '名前', 'b@example.ac.jp')")
+    conn.execute("INSERT INTO reviews (event_id, name, email, satisfaction) VALUES (1, '名前', 'a@example.ac.jp', 4)")
+    conn.execute("INSERT INTO archived_events (event_id, group_id, title, archived_at) VALUES (7, 1, '保管済み', '2000-01-01')")
+    conn.execute("INSERT INTO change_log (version, kind, event_id) VALUES (1, 'event_deleted', 9)")
+    conn.close()
+
+    storage.configure(path)
+    assert storage.connect().execute("PRAGMA user_version").fetchone()[0] == len(storage.MIGRATIONS)
+    assert seats(1) == (1, 0)
+    assert seats(2) == (1, 1)
+    assert storage.list_events_by_id([1])[0].review_count == 1
+    assert emails(storage.list_waitlist(2)) == ["b@example.ac.jp"]
+    assert storage.add_event(1, make_event()) == 10  # 保管・削除したイベントのIDより後
+    storage.delete_event(2)  # 外部キーは有効なので応募者・キャンセル待ちも消える
+    assert storage.list_waitlist(2) == []
+    assert storage.connect().execute("SELECT COUNT(*) FROM applicants WHERE event_id = 2").fetchone()[0] == 0